@@ -0,0 +1,90 @@
+"""
+对话链构建开销微基准：每次请求重建链 vs 进程内构建一次、按请求绑定 config。
+
+用法（项目根目录）：python -m benchmarks.chain_setup [--requests 200]
+
+LLM 使用 FakeListLLM、向量库使用空实现，只衡量链路本身的构建与调度开销，不访问模型服务。
+对话记录与关键词索引使用临时数据库，不影响 chroma_db 下的数据。
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import uuid
+
+from langchain_core.language_models.fake import FakeListLLM
+
+
+class _EmptyVectorStore:
+    def similarity_search(self, query, k=4, filter=None):
+        return []
+
+
+def _vector_store_getter(user_id, session_id):
+    return _EmptyVectorStore()
+
+
+def _use_temp_databases():
+    """在导入服务模块之前把对话记录与关键词索引指向临时目录"""
+    workdir = tempfile.mkdtemp(prefix="chain_setup_")
+    os.environ["CONVERSATION_DB_PATH"] = os.path.join(workdir, "conversation.sqlite3")
+    os.environ["KEYWORD_INDEX_PATH"] = os.path.join(workdir, "keyword_index.sqlite3")
+    return workdir
+
+
+def _build_chain(llm):
+    from service.chat_history import create_result_chain
+    from service.retrieval_chain import initialize_retrieval_chain
+
+    return create_result_chain(initialize_retrieval_chain(llm, 3, _vector_store_getter))
+
+
+def _invoke(chain, session_id):
+    from service.chat_history import clean_session_history
+
+    config = {"configurable": {"session_id": session_id, "user_id": "bench", "file_path": None}}
+    chain.invoke({"input": "合同的违约金条款是什么？"}, config=config)
+    clean_session_history(session_id)
+
+
+def _summary(name, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{name:<28} mean={statistics.mean(samples):8.3f}ms  p50={statistics.median(samples):8.3f}ms  "
+          f"p95={p95:8.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = _use_temp_databases()
+    print(f"临时数据目录：{workdir}")
+    from core.custom_llm import DeepSeekLLM  # 在设置数据库路径之后导入
+
+    answer_llm = FakeListLLM(responses=["ok"])
+
+    build, rebuilt, shared = [], [], []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        DeepSeekLLM(model="deepseek-r1:7b", base_url="http://127.0.0.1:11434")
+        chain = _build_chain(answer_llm)
+        build.append((time.perf_counter() - start) * 1000)
+        _invoke(chain, uuid.uuid4().hex)
+        rebuilt.append((time.perf_counter() - start) * 1000)
+
+    chain = _build_chain(answer_llm)
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        _invoke(chain, uuid.uuid4().hex)
+        shared.append((time.perf_counter() - start) * 1000)
+
+    _summary("chain build only", build)
+    _summary("per-request rebuild+invoke", rebuilt)
+    _summary("shared chain invoke", shared)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+DeepSeekLLM 连接复用基准：本地启动 Ollama 风格的桩服务（/api/generate，NDJSON 流式分块响应），
+对比每次调用新建连接与共享连接池两种方式的建连次数和首字耗时（TTFT）。
+
+用法（项目根目录）：python -m benchmarks.llm_client [--requests 200] [--concurrency 16] [--latency-ms 5]
+"""
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import requests
+
+from core.custom_llm import DeepSeekLLM
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持长连接
+    tokens = 8
+    latency_s = 0.005
+
+    def setup(self):
+        super().setup()
+        # 与 Ollama（Go net/http）一致关闭 Nagle，否则长连接上的小数据块会被延迟确认拖慢
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _write_chunk(self, payload: bytes):
+        self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        stream = body.get("stream", False)
+        time.sleep(self.latency_s)  # 模拟首个 token 的生成耗时
+        if not stream:
+            data = json.dumps({"response": "ok " * self.tokens, "done": True}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(self.tokens):
+            self._write_chunk(json.dumps({"response": "ok ", "done": i == self.tokens - 1}).encode() + b"\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # 未复用连接时短时间内大量建连，默认 backlog 为 5 会被重置
+
+
+def start_stub_server(latency_ms: float):
+    _StubHandler.latency_s = latency_ms / 1000
+    server = _StubServer(("127.0.0.1", 0), _StubHandler)
+    server.lock = threading.Lock()
+    server.connections = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _unpooled_stream_ttft(base_url: str) -> float:
+    """旧实现：每次调用直接 requests.post，不复用连接"""
+    start = time.perf_counter()
+    response = requests.post(f"{base_url}/api/generate", json={"model": "stub", "prompt": "hi", "stream": True},
+                             stream=True)
+    ttft = None
+    for line in response.iter_lines(decode_unicode=True):
+        if line and ttft is None:
+            ttft = (time.perf_counter() - start) * 1000
+    response.close()
+    return ttft
+
+
+def _pooled_stream_ttft(llm: DeepSeekLLM) -> float:
+    start = time.perf_counter()
+    ttft = None
+    for _ in llm._stream("hi"):
+        if ttft is None:
+            ttft = (time.perf_counter() - start) * 1000
+    return ttft
+
+
+async def _unpooled_astream_ttft(base_url: str) -> float:
+    """旧实现：每次调用新建 httpx.AsyncClient"""
+    start = time.perf_counter()
+    ttft = None
+    async with httpx.AsyncClient() as client:
+        async with client.stream("POST", f"{base_url}/api/generate",
+                                 json={"model": "stub", "prompt": "hi", "stream": True}) as response:
+            async for line in response.aiter_lines():
+                if line and ttft is None:
+                    ttft = (time.perf_counter() - start) * 1000
+    return ttft
+
+
+async def _pooled_astream_ttft(llm: DeepSeekLLM) -> float:
+    start = time.perf_counter()
+    ttft = None
+    async for _ in llm._astream("hi"):
+        if ttft is None:
+            ttft = (time.perf_counter() - start) * 1000
+    return ttft
+
+
+def _report(name, server, before, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{name:<18} connections={server.connections - before:5d}  ttft mean={statistics.mean(samples):7.2f}ms  "
+          f"p50={statistics.median(samples):7.2f}ms  p95={p95:7.2f}ms")
+
+
+def _run_threads(fn, requests_count, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda _: fn(), range(requests_count)))
+
+
+async def _run_async(fn, requests_count, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            return await fn()
+
+    return await asyncio.gather(*(one() for _ in range(requests_count)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    server = start_stub_server(args.latency_ms)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    llm = DeepSeekLLM(model="stub", base_url=base_url, pool_maxsize=args.concurrency)
+
+    before = server.connections
+    samples = _run_threads(lambda: _unpooled_stream_ttft(base_url), args.requests, args.concurrency)
+    _report("sync unpooled", server, before, samples)
+
+    before = server.connections
+    samples = _run_threads(lambda: _pooled_stream_ttft(llm), args.requests, args.concurrency)
+    _report("sync pooled", server, before, samples)
+
+    async def run_async():
+        before = server.connections
+        samples = await _run_async(lambda: _unpooled_astream_ttft(base_url), args.requests, args.concurrency)
+        _report("async unpooled", server, before, samples)
+
+        before = server.connections
+        samples = await _run_async(lambda: _pooled_astream_ttft(llm), args.requests, args.concurrency)
+        _report("async pooled", server, before, samples)
+        await llm.aclose()
+
+    asyncio.run(run_async())
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
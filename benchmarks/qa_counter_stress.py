@@ -0,0 +1,70 @@
+"""
+问答序号并发压力测试：多线程并发模拟对话轮次，每轮分配一次序号并写入问题与回答两条记录，
+检查每个会话的序号唯一、连续，且同一轮的问题与回答共用序号。
+
+用法（项目根目录）：python -m benchmarks.qa_counter_stress [--turns 2000] [--threads 32] [--sessions 8]
+使用临时数据库，不影响 chroma_db 下的数据。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--sessions", type=int, default=8)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="qa_counter_")
+    os.environ["CONVERSATION_DB_PATH"] = os.path.join(workdir, "conversation.sqlite3")
+    from service import sql  # 在设置数据库路径之后导入
+    sql.LEGACY_DB_PATH = os.path.join(workdir, "missing.sqlite3")
+    sql.init_conversation_messages()
+
+    def turn(i):
+        session_id = f"s{i % args.sessions}"
+        qa_id = sql.allocate_qa_id("stress", session_id)
+        message_id = str(uuid.uuid4())
+        sql.insert_into_conversation_messages("stress", session_id, 0, message_id, qa_id, "question", f"q{i}")
+        sql.insert_into_conversation_messages("stress", session_id, 0, message_id, qa_id, "answer", f"a{i}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(executor.map(turn, range(args.turns)))
+    elapsed = time.perf_counter() - start
+
+    with sql.pool.connection() as conn:
+        rows = conn.execute("SELECT session_id, qa_id, qa_type, message_id FROM conversation_messages").fetchall()
+
+    turns = defaultdict(dict)
+    errors = []
+    for session_id, qa_id, qa_type, message_id in rows:
+        entry = turns[session_id].setdefault(qa_id, {})
+        if qa_type in entry:
+            errors.append(f"{session_id}/{qa_id} 重复的 {qa_type}")
+        entry[qa_type] = message_id
+    for session_id, by_qa in turns.items():
+        numbers = sorted(int(qa_id[2:]) for qa_id in by_qa)
+        if numbers != list(range(1, len(numbers) + 1)):
+            errors.append(f"{session_id} 序号不连续")
+        for qa_id, entry in by_qa.items():
+            if entry.get("question") != entry.get("answer"):
+                errors.append(f"{session_id}/{qa_id} 问题与回答不属于同一轮")
+
+    print(f"{args.turns} 轮 / {args.threads} 线程 / {args.sessions} 会话，耗时 {elapsed:.2f}s，"
+          f"{args.turns / elapsed:.0f} 轮/s")
+    if errors:
+        print(f"发现 {len(errors)} 个问题，例如：", *errors[:10], sep="\n  ")
+        sys.exit(1)
+    print("序号唯一且连续，问题与回答共用序号")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,12 @@
 import os
-import shutil
 
 from fastapi import APIRouter, UploadFile, File, HTTPException, Form
 from starlette.responses import FileResponse
 
-from core.base.exception import ResponseModel
-from service.vector_store import upload_file
+from core.base.exception import ResponseModel, FileTooLargeError
+from service.file_registry import find_session_file, list_files
+from service.file_storage import save_upload_stream
+from service.ingestion_job import ingestion_queue, get_job
 
 # 创建一个路由组
 file_router = APIRouter(prefix="/file")
@@ -16,27 +17,30 @@ file_router = APIRouter(prefix="/file")
 async def upload(file: UploadFile = File(...),
                  user_id: str = Form(...),
                  session_id: str = Form(...)):
-    content = await file.read()  # 读取整个文件内容
-    max_size = 10 * 1024 * 1024  # 例如：2KB
-    if len(content) > max_size:
-        return ResponseModel(message="文件过大，最大10MB", code=500)
-
     # 目标文件路径
     upload_path = f"./uploads/{session_id}/{file.filename}"
 
-    # 创建上传目录，如果不存在的话
-    os.makedirs(os.path.dirname(upload_path), exist_ok=True)
+    # 分块写入磁盘，边写边校验大小并计算内容哈希
+    try:
+        stored = await save_upload_stream(file, upload_path)
+    except FileTooLargeError as e:
+        return ResponseModel(message=str(e), code=500)
 
-    # 重置文件指针到开头，防止已经被读取过
-    file.file.seek(0)
+    # 解析与向量化交给后台任务队列，接口立即返回任务ID
+    job_id = ingestion_queue.submit(file_path=upload_path, user_id=user_id, session_id=session_id,
+                                    file_hash=stored.sha256)
 
-    # 使用 'w' 模式打开文件，会清空原文件内容
-    with open(upload_path, 'w', encoding='utf-8') as fp:
-        print('hello world', file=fp)
+    return ResponseModel(message=f"File {file.filename} uploaded successfully!",
+                         data={"file_path": upload_path, "job_id": job_id})
 
-    upload_file(file_path=upload_path, user_id=user_id, session_id=session_id)
 
-    return ResponseModel(message=f"File {file.filename} uploaded successfully!", data=upload_path)
+# 查询入库任务状态
+@file_router.get("/jobs/{job_id}", summary="入库任务状态查询接口")
+async def job_status(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return ResponseModel(data=job)
 
 
 # 下载文件
@@ -44,7 +48,13 @@ async def upload(file: UploadFile = File(...),
 async def download_file(session_id: str, filename: str):
     file_path = f"./uploads/{session_id}/{filename}"
 
-    if not os.path.exists(file_path):
+    if find_session_file(session_id, file_path) is None or not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
 
     return FileResponse(file_path)
+
+
+# 查询会话内已上传的文件
+@file_router.get("/list", summary="会话文件列表接口")
+async def file_list(user_id: str, session_id: str):
+    return ResponseModel(data=list_files(user_id, session_id))
@@ -1,38 +1,100 @@
+import asyncio
 import json
+import logging
+import os
 import uuid
+from contextlib import aclosing
 from datetime import datetime, timezone
-from typing import Optional
+from functools import partial
+from typing import AsyncIterator, Optional
 
-from fastapi import APIRouter
+import anyio
+from fastapi import APIRouter, Request
+from starlette.requests import ClientDisconnect
 from starlette.responses import StreamingResponse
 
-from service.chat_history import get_session_history
+from core.base.exception import ResponseModel
 from service.chat_service import generate_stream
-from service.sql import insert_into_conversation_messages, query_session_history, query_next_qa_id
+from service.message_writer import message_writer
+from service.sql import (
+    HISTORY_PAGE_SIZE, MESSAGE_STATUS_CANCELLED, MESSAGE_STATUS_DONE, allocate_qa_id,
+    insert_into_conversation_messages, query_session_history,
+)
+
+# 配置日志
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 检测客户端断开的轮询间隔（秒），断开后在该时间内取消上游生成
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", 0.5))
 
 # 创建一个路由组
 subscribe_router = APIRouter(prefix="/subscribe")
 
 
+async def _wait_for_disconnect(request: Request):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+async def _until_disconnected(request: Request, stream: AsyncIterator) -> AsyncIterator:
+    """
+    逐个产出 stream 的元素，客户端断开时取消正在等待的下一个元素并抛出 ClientDisconnect。
+
+    取消沿生成链传递到 DeepSeekLLM._astream，退出其中的流式响应上下文并关闭到模型服务的连接，模型随之停止生成。
+    服务器直接取消响应任务（ASGI spec < 2.4 时 Starlette 的 listen_for_disconnect）或消费方提前关闭时同样如此。
+    """
+    disconnected = asyncio.create_task(_wait_for_disconnect(request))
+    next_item: Optional[asyncio.Future] = None
+    try:
+        while True:
+            next_item = asyncio.ensure_future(stream.__anext__())
+            await asyncio.wait({next_item, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_item.done():
+                raise ClientDisconnect()
+            try:
+                item = next_item.result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        disconnected.cancel()
+        # 本任务可能已被取消，在屏蔽取消的作用域内等待：先取消仍在进行的 __anext__，再关闭上游生成器
+        with anyio.CancelScope(shield=True):
+            if next_item is not None:
+                next_item.cancel()
+                await asyncio.gather(next_item, return_exceptions=True)
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+
 @subscribe_router.get("/", summary="流式响应接口")
-def subscribe(user_input: str, user_id: str, session_id: str, file_path: Optional[str] = None) -> StreamingResponse:
+async def subscribe(request: Request, user_input: str, user_id: str, session_id: str,
+                    file_path: Optional[str] = None) -> StreamingResponse:
+    # 全链路异步：检索、历史与生成在事件循环上等待，阻塞的 SQLite 调用放到线程池，长连接不占用线程
     unique_id = str(uuid.uuid4())
-    insert_into_conversation_messages(
+    # 每轮只分配一次序号，问题与回答共用
+    qa_id = await asyncio.to_thread(allocate_qa_id, user_id=user_id, session_id=session_id)
+    # 消息交给后写写入器批量提交，不等待落盘
+    await message_writer.asubmit(
         user_id=user_id,
         session_id=session_id,
         parent_id=0,
         message_id=unique_id,
-        qa_id=query_next_qa_id(user_id=user_id, session_id=session_id),
+        qa_id=qa_id,
         qa_type="question",
         message_content=user_input
     )
 
-    ret = generate_stream(file_path=file_path, user_input=user_input, user_id=user_id, session_id=session_id)
-    session_history = get_session_history(session_id)
-    qaId = len(session_history.messages) // 2 + 1
+    timings = {}
+    ret = generate_stream(file_path=file_path, user_input=user_input, user_id=user_id, session_id=session_id,
+                          timings=timings)
+    # 会话历史只保留最近的消息，轮次序号直接取本轮分配的 qa_id
+    qaId = int(qa_id[2:])
 
     def format_message(data: str, finished: bool) -> str:
-        """格式化流式输出的消息数据"""
+        """格式化流式输出的消息数据，结束消息附带各阶段耗时"""
         js_data = {
             "sceneName": "文档提取",
             "finished": "true" if finished else "false",
@@ -40,30 +102,49 @@ def subscribe(user_input: str, user_id: str, session_id: str, file_path: Optiona
             "answerRenderType": "markdown",
             "qaId": qaId
         }
+        if finished:
+            js_data["timings"] = timings
         return f"data: {json.dumps(js_data, ensure_ascii=False)}\n\n"
 
-    def predict():
-        """流式返回生成的内容"""
-        result = ""
-        for token in ret:
-            # 统一处理 token，无论是字符串还是字典形式
-            if isinstance(token, dict) and "answer" in token:
-                result += token['answer']
-                yield format_message(token['answer'], finished=False)
-            elif isinstance(token, str):
-                result += token
-                yield format_message(token, finished=False)
-
-        # 发送结束信号
-        insert_into_conversation_messages(
+    def answer_fields(content: str, status: str) -> dict:
+        return dict(
             user_id=user_id,
             session_id=session_id,
             parent_id=0,
             message_id=unique_id,
-            qa_id=query_next_qa_id(user_id=user_id, session_id=session_id),
+            qa_id=qa_id,
             qa_type="answer",
-            message_content=result
+            message_content=content,
+            status=status,
         )
+
+    async def predict():
+        """流式返回生成的内容，客户端断开时中止生成并保存已生成的部分"""
+        result = ""
+        try:
+            # 响应提前结束时 aclosing 立即关闭 _until_disconnected，不依赖垃圾回收来停止上游生成
+            async with aclosing(_until_disconnected(request, ret)) as tokens:
+                async for token in tokens:
+                    # 统一处理 token，无论是字符串还是字典形式
+                    if isinstance(token, dict) and "answer" in token:
+                        result += token['answer']
+                        yield format_message(token['answer'], finished=False)
+                    elif isinstance(token, str):
+                        result += token
+                        yield format_message(token, finished=False)
+        except ClientDisconnect:
+            logger.info("客户端已断开，已取消生成，session_id=%s", session_id)
+            await message_writer.asubmit(**answer_fields(result, MESSAGE_STATUS_CANCELLED))
+            return
+        except asyncio.CancelledError:
+            # 服务器在检测到断开后直接取消了响应任务：本任务中不能再等待，在线程池中入队，不受取消影响
+            logger.info("响应任务被取消，session_id=%s", session_id)
+            asyncio.get_running_loop().run_in_executor(
+                None, partial(message_writer.submit, **answer_fields(result, MESSAGE_STATUS_CANCELLED)))
+            raise
+
+        # 回答入队后立即发送结束信号，不等待写入数据库
+        await message_writer.asubmit(**answer_fields(result, MESSAGE_STATUS_DONE))
         yield format_message("[DONE]", finished=True)
 
     return StreamingResponse(predict(), media_type="text/event-stream")
@@ -84,6 +165,9 @@ def create_session(user_input: str, user_id: str, ):
     )
 
 
-@subscribe_router.get("/search_history")
-def session_history(user_id: str, session_id: str):
-    return query_session_history(user_id, session_id)
+@subscribe_router.get("/search_history", summary="会话历史分页查询接口")
+async def session_history(user_id: str, session_id: str, cursor: Optional[int] = None,
+                          limit: int = HISTORY_PAGE_SIZE, since: Optional[str] = None):
+    page = await asyncio.to_thread(query_session_history, user_id, session_id, cursor=cursor, limit=limit,
+                                   since=since)
+    return ResponseModel(data=page)
@@ -8,3 +8,27 @@ class ResponseModel(BaseModel):
     code: int = 200  # 状态码，200 表示成功
     message: str = "成功"  # 提示信息
     data: Optional[Any] = None  # 具体数据
+
+
+class FileTooLargeError(Exception):
+    """上传文件超过大小限制时抛出"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        super().__init__(f"文件过大，最大{max_size // (1024 * 1024)}MB")
+
+
+class ParseWorkerError(RuntimeError):
+    """文档解析子进程异常（超时、崩溃或解析报错）"""
+
+
+class ParseTimeoutError(ParseWorkerError):
+    """文档解析超过单任务超时时间，对应的子进程已被终止"""
+
+
+class ParseWorkerCrashedError(ParseWorkerError):
+    """文档解析子进程意外退出（如段错误）"""
+
+
+class IngestionSupersededError(RuntimeError):
+    """同一文件有更新的入库任务，旧任务在下一个批次前停止"""
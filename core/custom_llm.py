@@ -1,10 +1,21 @@
+import asyncio
 import json
+import os
+import threading
 import requests
 import httpx
 from typing import Any, List, Optional, Union, Iterator, AsyncIterator
 from langchain_core.callbacks import CallbackManagerForLLMRun, AsyncCallbackManagerForLLMRun
 from langchain_core.language_models import LLM
 from langchain_core.outputs import GenerationChunk
+from pydantic import PrivateAttr
+from requests.adapters import HTTPAdapter
+
+# 🛠 配置部分
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 5))  # 建立连接超时（秒）
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", 120))  # 两次读取之间的超时（秒），流式响应按每个数据块计算
+LLM_POOL_MAXSIZE = int(os.getenv("LLM_POOL_MAXSIZE", 32))  # 连接池中保持的最大连接数
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 60))  # 空闲长连接保留时间（秒）
 
 
 class DeepSeekLLM(LLM):
@@ -35,6 +46,23 @@ class DeepSeekLLM(LLM):
     base_url: Optional[str] = None
     """模型托管的基本 URL"""
 
+    num_predict: Optional[int] = None
+    """单次生成的最大 token 数，None 表示不限制。可通过 llm.bind(num_predict=...) 按调用覆盖"""
+
+    connect_timeout: float = LLM_CONNECT_TIMEOUT
+    """建立连接的超时时间（秒）"""
+
+    read_timeout: float = LLM_READ_TIMEOUT
+    """读取响应的超时时间（秒），流式调用中指两个数据块之间的最长间隔"""
+
+    pool_maxsize: int = LLM_POOL_MAXSIZE
+    """同步与异步连接池各自保持的最大连接数"""
+
+    _session: Optional[requests.Session] = PrivateAttr(default=None)
+    _async_client: Optional[httpx.AsyncClient] = PrivateAttr(default=None)
+    _async_loop: Optional[asyncio.AbstractEventLoop] = PrivateAttr(default=None)
+    _client_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
     @property
     def _identifying_params(self) -> dict:
         """返回标识模型的参数字典"""
@@ -47,6 +75,88 @@ class DeepSeekLLM(LLM):
         """返回 LLM 的类型"""
         return "deepseek-llm"
 
+    def _get_session(self) -> requests.Session:
+        """实例共享的 requests 会话，HTTP/1.1 长连接在多次调用间复用"""
+        if self._session is None:
+            with self._client_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, pool_block=False)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    session.headers["Content-Type"] = "application/json"
+                    self._session = session
+        return self._session
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """实例共享的 httpx 异步客户端；连接池绑定事件循环，循环变化时重新创建并关闭旧客户端"""
+        loop = asyncio.get_running_loop()
+        with self._client_lock:
+            if self._async_client is not None and self._async_loop is loop:
+                return self._async_client
+            stale_client, stale_loop = self._async_client, self._async_loop
+            client = httpx.AsyncClient(
+                headers={"Content-Type": "application/json"},
+                limits=httpx.Limits(max_connections=self.pool_maxsize,
+                                    max_keepalive_connections=self.pool_maxsize,
+                                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY),
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            )
+            self._async_client, self._async_loop = client, loop
+        if stale_client is not None:
+            self._discard_async_client(stale_client, stale_loop)
+        return client
+
+    @staticmethod
+    def _discard_async_client(client: httpx.AsyncClient, loop: Optional[asyncio.AbstractEventLoop]):
+        """
+        关闭绑定在旧事件循环上的客户端。连接只能在创建它的循环中关闭：旧循环仍在运行时把 aclose 提交给它；
+        旧循环已停止或关闭时无法再在其上执行，释放引用后由垃圾回收关闭底层套接字。
+        """
+        if loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+
+    @property
+    def _timeout(self) -> tuple:
+        return self.connect_timeout, self.read_timeout
+
+    def close(self):
+        """关闭同步连接池"""
+        with self._client_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    async def aclose(self):
+        """关闭同步与异步连接池"""
+        self.close()
+        with self._client_lock:
+            client, loop = self._async_client, self._async_loop
+            self._async_client, self._async_loop = None, None
+        if client is None:
+            return
+        if loop is asyncio.get_running_loop():
+            await client.aclose()
+        else:
+            self._discard_async_client(client, loop)
+
+    def _build_payload(self, prompt: str, stream: bool, **kwargs: Any) -> dict:
+        """构造 /api/generate 请求体，生成长度等采样参数放入 options"""
+        options = {}
+        num_predict = kwargs.pop("num_predict", self.num_predict)
+        if num_predict is not None:
+            options["num_predict"] = num_predict
+        data = {
+            "model": self.model,
+            "prompt": prompt,
+            "top_k": self.top_k,
+            "stream": stream,
+            **kwargs,  # 支持传入更多自定义参数
+        }
+        if options:
+            data["options"] = options
+        return data
+
     def _call(
             self,
             prompt: str,
@@ -67,21 +177,14 @@ class DeepSeekLLM(LLM):
         返回:
             模型生成的文本输出，去除了提示文本。
         """
-        headers = {"Content-Type": "application/json"}
-        data = {
-            "model": self.model,
-            "prompt": prompt,
-            "top_k": self.top_k,
-            "stream": False,  # 非流式调用，保持与 _stream 一致的 API 结构
-            **kwargs,  # 支持传入更多自定义参数
-        }
+        # 非流式调用，保持与 _stream 一致的 API 结构
+        data = self._build_payload(prompt, stream=False, **kwargs)
 
         try:
-            response = requests.post(
+            response = self._get_session().post(
                 f"{self.base_url}/api/generate",
-                headers=headers,
                 json=data,
-                timeout=60  # 设置超时，防止请求挂起
+                timeout=self._timeout  # 设置超时，防止请求挂起
             )
             response.raise_for_status()  # 如果响应状态码不是 2xx，会抛出异常
 
@@ -105,6 +208,37 @@ class DeepSeekLLM(LLM):
                 callbacks.on_llm_error(e)
             raise RuntimeError(f"请求失败: {e}")
 
+    async def _acall(
+            self,
+            prompt: str,
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+    ) -> str:
+        """_call 的异步版本，使用共享的异步连接池，不占用线程"""
+        data = self._build_payload(prompt, stream=False, **kwargs)
+
+        try:
+            response = await self._get_async_client().post(f"{self.base_url}/api/generate", json=data)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            if run_manager:
+                await run_manager.on_llm_error(e)
+            raise RuntimeError(f"请求失败: {e}")
+
+        content = response.json().get("response", "")
+        if run_manager:
+            await run_manager.on_llm_new_token(content)
+
+        # 检查停止词并截断输出
+        if stop:
+            for s in stop:
+                if s in content:
+                    content = content.split(s)[0]
+                    break
+
+        return content
+
     def _stream(
             self,
             prompt: str,
@@ -125,41 +259,36 @@ class DeepSeekLLM(LLM):
         返回:
             一个 GenerationChunk（生成块）的迭代器，每次返回一个部分生成结果。
         """
-        headers = {"Content-Type": "application/json"}
-        data = {
-            "model": self.model,
-            "prompt": prompt,
-            "top_k": self.top_k,
-            "stream": True  # 强制开启流式输出
-        }
+        data = self._build_payload(prompt, stream=True, **kwargs)  # 强制开启流式输出
 
-        response = requests.post(
-            f"{self.base_url}/api/generate",
-            headers=headers,
-            json=data,
-            stream=True  # 使用 stream=True 以启用流式请求
-        )
-        response.raise_for_status()
-
-        # 逐行解析服务器推送事件 (SSE) 或流响应
-        for line in response.iter_lines(decode_unicode=True):
-            if line:
-                try:
-                    data = json.loads(line)
-                    content = data.get("response", "")
-                    if run_manager:
-                        run_manager.on_llm_new_token(content)
-
-                    # 返回一个 GenerationChunk
-                    yield GenerationChunk(text=content)
-
-                    # 检查是否有停止词，并在遇到时停止流
-                    if stop and any(s in content for s in stop):
-                        break
-                except json.JSONDecodeError as e:
-                    if run_manager:
-                        run_manager.on_llm_error(e)
-                    continue
+        # 使用 stream=True 以启用流式请求；with 块结束（含提前 break 或生成器被关闭）时释放连接回连接池
+        with self._get_session().post(
+                f"{self.base_url}/api/generate",
+                json=data,
+                stream=True,
+                timeout=self._timeout,
+        ) as response:
+            response.raise_for_status()
+
+            # 逐行解析服务器推送事件 (SSE) 或流响应
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    try:
+                        data = json.loads(line)
+                        content = data.get("response", "")
+                        if run_manager:
+                            run_manager.on_llm_new_token(content)
+
+                        # 返回一个 GenerationChunk
+                        yield GenerationChunk(text=content)
+
+                        # 检查是否有停止词，并在遇到时停止流
+                        if stop and any(s in content for s in stop):
+                            break
+                    except json.JSONDecodeError as e:
+                        if run_manager:
+                            run_manager.on_llm_error(e)
+                        continue
 
     async def _astream(
             self,
@@ -181,32 +310,27 @@ class DeepSeekLLM(LLM):
         返回:
             一个异步的 GenerationChunk（生成块）迭代器，每次返回一个部分生成结果。
         """
-        headers = {"Content-Type": "application/json"}
-        data = {
-            "model": self.model,
-            "prompt": prompt,
-            "top_k": self.top_k,
-            "stream": True
-        }
-
-        async with httpx.AsyncClient() as client:
-            async with client.stream("POST", f"{self.base_url}/api/generate", headers=headers, json=data) as response:
-                response.raise_for_status()
-                async for line in response.aiter_lines():
-                    if line:
-                        try:
-                            data = json.loads(line)
-                            content = data.get("response", "")
-                            if run_manager:
-                                await run_manager.on_llm_new_token(content)
-
-                            # 异步返回一个 GenerationChunk
-                            yield GenerationChunk(text=content)
-
-                            # 检查是否有停止词，并在遇到时停止流
-                            if stop and any(s in content for s in stop):
-                                break
-                        except json.JSONDecodeError as e:
-                            if run_manager:
-                                await run_manager.on_llm_error(e)
-                            continue
+        data = self._build_payload(prompt, stream=True, **kwargs)
+
+        client = self._get_async_client()
+        # 调用方取消或提前结束时退出 async with：未读完的响应连接被直接关闭（不放回连接池），模型服务随之停止生成
+        async with client.stream("POST", f"{self.base_url}/api/generate", json=data) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    try:
+                        data = json.loads(line)
+                        content = data.get("response", "")
+                        if run_manager:
+                            await run_manager.on_llm_new_token(content)
+
+                        # 异步返回一个 GenerationChunk
+                        yield GenerationChunk(text=content)
+
+                        # 检查是否有停止词，并在遇到时停止流
+                        if stop and any(s in content for s in stop):
+                            break
+                    except json.JSONDecodeError as e:
+                        if run_manager:
+                            await run_manager.on_llm_error(e)
+                        continue
@@ -0,0 +1,28 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# 阶段耗时字典在 RunnableConfig["configurable"] 中的键名，链路内各阶段通过 config 取到同一个字典
+STAGE_TIMINGS_KEY = "stage_timings"
+
+
+def get_stage_timings(config: Optional[dict]) -> Optional[Dict[str, float]]:
+    """从 RunnableConfig 中取出当前请求的阶段耗时字典（毫秒），未开启统计时返回 None"""
+    if not config:
+        return None
+    return (config.get("configurable") or {}).get(STAGE_TIMINGS_KEY)
+
+
+def record_stage(timings: Optional[Dict[str, float]], name: str, elapsed_ms: float):
+    if timings is not None:
+        timings[name] = round(timings.get(name, 0.0) + elapsed_ms, 1)
+
+
+@contextmanager
+def stage(timings: Optional[Dict[str, float]], name: str):
+    """统计代码块耗时并累加到阶段耗时字典"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(timings, name, (time.perf_counter() - start) * 1000)
@@ -1,9 +1,39 @@
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from controller.file_controller import file_router
 from controller.subscribe_controller import subscribe_router
+from service.chat_service import close_chat_chain, get_chat_chain
+from service.file_storage import UploadSizeLimitMiddleware
+from service.ingestion_job import ingestion_queue
+from service.message_writer import message_writer
+from service.parse_pool import parse_engine
+from service.pdf_stream import shutdown_pdf_executor
+from service.reranker import reranker
+from service.vector_store import backfill_file_registry, backfill_keyword_index, migrate_legacy_collection
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # 启动时把分片前的共享集合迁移到租户集合、补登记旧版本入库的文件并补建关键词索引、
+    # 恢复上次未完成的入库任务，预加载重排序模型并构建对话链
+    migrate_legacy_collection()
+    backfill_file_registry()
+    backfill_keyword_index()
+    ingestion_queue.recover()
+    reranker.warm_up()
+    get_chat_chain()
+    yield
+    await close_chat_chain()
+    # 写完队列中剩余的对话消息
+    message_writer.close()
+    ingestion_queue.shutdown()
+    parse_engine.shutdown()
+    shutdown_pdf_executor()
+
 
 # 创建主应用
 app = FastAPI(
@@ -13,13 +43,17 @@ app = FastAPI(
     contact={
         "name": "黄任翔",
         "mobile": "15236325327",
-    }
+    },
+    lifespan=lifespan,
 )
 
 # 将路由组包含到主应用中
 app.include_router(subscribe_router)
 app.include_router(file_router)
 
+# 上传接口在表单解析之前限制请求体大小（先注册，位于 CORS 内层，413 响应也带跨域响应头）
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # 启用 CORS 中间件
 app.add_middleware(
     CORSMiddleware,
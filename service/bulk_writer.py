@@ -0,0 +1,57 @@
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class BulkWriter:
+    """
+    两级流水线写入器：第 N 批在后台线程写入向量库的同时，调用方继续向量化第 N+1 批。
+
+    同一时刻最多只有一个批次在写入，内存占用保持在两个批次以内；
+    每批写入成功后回调 on_commit(batch_no, size)，用于记录断点以便崩溃后续传。
+    """
+
+    def __init__(self, write_fn: Callable[[Any], None],
+                 on_commit: Optional[Callable[[int, int], None]] = None, name: str = "bulk-writer"):
+        self._write_fn = write_fn
+        self._on_commit = on_commit
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._pending: Optional[Future] = None
+        self._started = time.perf_counter()
+        self.committed_chunks = 0
+        self.committed_batches = 0
+
+    def _write(self, batch_no: int, size: int, payload: Any):
+        self._write_fn(payload)
+        self.committed_chunks += size
+        self.committed_batches += 1
+        if self._on_commit:
+            self._on_commit(batch_no, size)
+        logger.debug("批次 %d 已写入（%d 块），累计吞吐 %.1f 块/秒", batch_no, size, self.throughput)
+
+    def submit(self, batch_no: int, size: int, payload: Any):
+        """提交一个批次写入；上一批次尚未写完时先等待，写入异常在此处抛出"""
+        self.wait()
+        self._pending = self._executor.submit(self._write, batch_no, size, payload)
+
+    def wait(self):
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    @property
+    def throughput(self) -> float:
+        """已写入块数 / 总耗时（块/秒）"""
+        elapsed = time.perf_counter() - self._started
+        return self.committed_chunks / elapsed if elapsed > 0 else 0.0
@@ -1,35 +1,225 @@
+import asyncio
+import json
 import logging
-from typing import Any, Generator
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Dict, List, Optional, Sequence
 
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
 from langchain_core.runnables import RunnableWithMessageHistory
 
+from core.stage_timer import STAGE_TIMINGS_KEY, record_stage
+from service.sql import pool
+
 # 配置日志记录
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-# 全局会话历史存储字典
-store = {}  # 存储历史对话
+# 🛠 配置部分
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", 40))  # 每个会话参与对话的最近消息条数
+CHAT_HISTORY_CACHE_SESSIONS = int(os.getenv("CHAT_HISTORY_CACHE_SESSIONS", 1000))  # 内存中缓存的会话数上限
+CHAT_HISTORY_CACHE_BYTES = int(os.getenv("CHAT_HISTORY_CACHE_BYTES", 64 * 1024 * 1024))  # 缓存消息的估算内存上限
+CHAT_HISTORY_SIZE_FACTOR = float(os.getenv("CHAT_HISTORY_SIZE_FACTOR", 1.5))  # 消息内存相对 UTF-8 序列化字节数的倍数
+CHAT_HISTORY_MESSAGE_OVERHEAD = 1536  # 单个消息对象（字段、字典与元数据）的固定开销估算，字节
+CHAT_HISTORY_IDLE_SECONDS = float(os.getenv("CHAT_HISTORY_IDLE_SECONDS", 1800))  # 会话空闲多久后移出缓存
+
+
+def init_chat_history():
+    with pool.connection() as conn:
+        conn.executescript('''
+        CREATE TABLE IF NOT EXISTS chat_history_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            message TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_chat_history_messages_session ON chat_history_messages (session_id);
+        ''')
+
+
+def _estimate_size(payload: str) -> int:
+    """按 UTF-8 字节数估算一条消息在缓存中的内存占用（len(str) 是字符数，中文会被低估约 3 倍）"""
+    return int(len(payload.encode("utf-8")) * CHAT_HISTORY_SIZE_FACTOR) + CHAT_HISTORY_MESSAGE_OVERHEAD
+
+
+class _CachedSession:
+    __slots__ = ("messages", "sizes", "last_id", "last_access")
+
+    def __init__(self, messages: List[BaseMessage], sizes: List[int], last_id: int):
+        self.messages = messages
+        self.sizes = sizes  # 每条消息的估算内存占用，用于统计缓存占用
+        self.last_id = last_id
+        self.last_access = time.monotonic()
+
+    @property
+    def size(self) -> int:
+        return sum(self.sizes)
+
+
+class SessionHistoryCache:
+    """
+    会话最近消息的内存 LRU，按会话数和消息估算内存两个上限淘汰，空闲超时的会话在访问时顺带清理。
+
+    每次读取先用 (session_id) 索引查询最新消息 id，与缓存不一致（如其他 worker 写入过）时重新加载。
+    """
+
+    def __init__(self, max_sessions: int = CHAT_HISTORY_CACHE_SESSIONS, max_bytes: int = CHAT_HISTORY_CACHE_BYTES,
+                 idle_seconds: float = CHAT_HISTORY_IDLE_SECONDS, max_messages: int = CHAT_HISTORY_MAX_MESSAGES):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.max_messages = max_messages
+        self._sessions: "OrderedDict[str, _CachedSession]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _latest_id(conn, session_id: str) -> int:
+        return conn.execute('SELECT MAX(id) FROM chat_history_messages WHERE session_id = ?;',
+                            (session_id,)).fetchone()[0] or 0
+
+    def _load(self, conn, session_id: str) -> _CachedSession:
+        rows = conn.execute('''
+        SELECT id, message FROM chat_history_messages WHERE session_id = ? ORDER BY id DESC LIMIT ?;
+        ''', (session_id, self.max_messages)).fetchall()
+        rows.reverse()
+        messages = messages_from_dict([json.loads(row["message"]) for row in rows])
+        sizes = [_estimate_size(row["message"]) for row in rows]
+        return _CachedSession(messages, sizes, rows[-1]["id"] if rows else 0)
+
+    def _evict(self):
+        """在持有锁时调用：先清理空闲会话，再按 LRU 淘汰到上限以内"""
+        now = time.monotonic()
+        while self._sessions:
+            entry = next(iter(self._sessions.values()))
+            over_limit = len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes
+            if not over_limit and now - entry.last_access < self.idle_seconds:
+                break
+            self._sessions.popitem(last=False)
+            self._bytes -= entry.size
+
+    def _put(self, session_id: str, entry: _CachedSession):
+        old = self._sessions.pop(session_id, None)
+        if old is not None:
+            self._bytes -= old.size
+        self._sessions[session_id] = entry
+        self._bytes += entry.size
+        self._evict()
+
+    def get(self, session_id: str) -> List[BaseMessage]:
+        with pool.connection() as conn:
+            latest_id = self._latest_id(conn, session_id)
+            with self._lock:
+                entry = self._sessions.get(session_id)
+                if entry is not None and entry.last_id == latest_id:
+                    entry.last_access = time.monotonic()
+                    self._sessions.move_to_end(session_id)
+                    return list(entry.messages)
+            entry = self._load(conn, session_id)
+        with self._lock:
+            self._put(session_id, entry)
+        return list(entry.messages)
+
+    def append(self, session_id: str, messages: Sequence[BaseMessage]):
+        if not messages:
+            return
+        payloads = [json.dumps(message_to_dict(message), ensure_ascii=False) for message in messages]
+        now = time.time()
+        with pool.connection() as conn:
+            ids = [conn.execute('''
+            INSERT INTO chat_history_messages (session_id, message, created_at) VALUES (?, ?, ?) RETURNING id;
+            ''', (session_id, payload, now)).fetchone()[0] for payload in payloads]
+            # 在同一写事务内查询本次写入之前的最新消息，用于判断缓存是否仍然完整
+            previous_id = conn.execute('SELECT MAX(id) FROM chat_history_messages WHERE session_id = ? AND id < ?;',
+                                       (session_id, ids[0])).fetchone()[0] or 0
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry.last_id != previous_id:
+                # 缓存中没有该会话或已过期，下次读取时重新加载
+                if entry is not None:
+                    self._bytes -= self._sessions.pop(session_id).size
+                return
+            self._bytes -= entry.size
+            entry.messages.extend(messages)
+            entry.sizes.extend(_estimate_size(payload) for payload in payloads)
+            overflow = len(entry.messages) - self.max_messages
+            if overflow > 0:
+                del entry.messages[:overflow]
+                del entry.sizes[:overflow]
+            entry.last_id = ids[-1]
+            entry.last_access = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            self._bytes += entry.size
+            self._evict()
+
+    def clear(self, session_id: str):
+        with pool.connection() as conn:
+            conn.execute('DELETE FROM chat_history_messages WHERE session_id = ?;', (session_id,))
+        self.discard(session_id)
+
+    def discard(self, session_id: str):
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is not None:
+                self._bytes -= entry.size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sessions": len(self._sessions), "bytes": self._bytes}
+
+
+init_chat_history()
+history_cache = SessionHistoryCache()
+
+
+class SqliteChatMessageHistory(BaseChatMessageHistory):
+    """
+    持久化到 SQLite 的会话历史，重启及多个 worker 之间共享。
+
+    只保留最近 CHAT_HISTORY_MAX_MESSAGES 条消息参与对话，热点会话缓存在进程内的 LRU 中。
+    """
+
+    def __init__(self, session_id: str, cache: SessionHistoryCache = history_cache):
+        self.session_id = session_id
+        self._cache = cache
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return self._cache.get(self.session_id)
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        return await asyncio.to_thread(self._cache.get, self.session_id)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self._cache.append(self.session_id, messages)
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        await asyncio.to_thread(self._cache.append, self.session_id, messages)
+
+    def clear(self) -> None:
+        self._cache.clear(self.session_id)
+
+    async def aclear(self) -> None:
+        await asyncio.to_thread(self._cache.clear, self.session_id)
 
 
 def get_session_history(session_id: str) -> BaseChatMessageHistory:
     """
-    获取会话历史记录，如果不存在则初始化一个新的 ChatMessageHistory。
+    获取会话历史记录，消息按需从 SQLite 加载。
     """
-    if session_id not in store:
-        logger.info("会话 %s 不存在历史记录，初始化新记录。", session_id)
-        store[session_id] = ChatMessageHistory()
-    return store[session_id]
+    return SqliteChatMessageHistory(session_id)
 
 
 def clean_session_history(session_id: str):
-    store.pop(session_id, None)
+    history_cache.clear(session_id)
 
 
-def _get_result_chain(retrieval_chain: Any) -> RunnableWithMessageHistory:
+def create_result_chain(retrieval_chain: Any) -> RunnableWithMessageHistory:
     """
-    根据检索链和会话ID构建带历史记录管理的 Runnable 对象。
+    根据检索链构建带历史记录管理的 Runnable 对象，会话ID在调用时通过 config 传入，可在请求间复用。
     """
     return RunnableWithMessageHistory(
         runnable=retrieval_chain,
@@ -40,27 +230,38 @@ def _get_result_chain(retrieval_chain: Any) -> RunnableWithMessageHistory:
     )
 
 
-def chat_with_history_stream(
-        retrieval_chain: Any,
+async def chat_with_history_stream(
+        result_chain: RunnableWithMessageHistory,
         user_input: str,
         session_id: str,
         type: str,
-) -> Generator[Any, None, None]:
+        timings: Optional[Dict[str, float]] = None,
+        scope: Optional[Dict[str, Any]] = None,
+) -> AsyncGenerator[Any, None]:
     """
-    进行带历史记录的对话，支持流式输出。
+    进行带历史记录的对话，异步流式输出，等待模型期间不占用线程。
 
-    :param retrieval_chain: 检索链或对话链对象
+    :param result_chain: create_result_chain 构建的带历史记录的链
     :param user_input: 用户输入
     :param session_id: 会话ID
     :param type: 检索链类型
+    :param timings: 可选的阶段耗时字典（毫秒），链路内的改写、检索、重排序及首字耗时写入其中
+    :param scope: 本次请求绑定到链上的运行时参数，如检索范围 user_id/file_path
     :yield: 逐步生成的对话输出
     """
-    config = {'configurable': {'session_id': session_id}}
+    timings = {} if timings is None else timings
+    config = {'configurable': {**(scope or {}), 'session_id': session_id, STAGE_TIMINGS_KEY: timings}}
+    start = time.perf_counter()
     try:
-        result_chain = _get_result_chain(retrieval_chain)
         logger.info("开始流式对话处理，session_id=%s", session_id)
-        for item in result_chain.stream(input={'input': user_input}, config=config):
+        first_token = True
+        async for item in result_chain.astream(input={'input': user_input}, config=config):
+            if first_token and isinstance(item, dict) and "answer" in item:
+                first_token = False
+                record_stage(timings, "first_token_ms", (time.perf_counter() - start) * 1000)
             yield item
+        record_stage(timings, "total_ms", (time.perf_counter() - start) * 1000)
+        logger.info("流式对话完成，session_id=%s, 阶段耗时=%s", session_id, timings)
     except Exception as e:
         logger.exception("调用 chat_with_history_stream 时发生异常：%s", e)
         raise
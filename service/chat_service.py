@@ -1,14 +1,16 @@
 import logging
 import os
-from typing import Optional, Any
+import threading
+from typing import Any, Dict, Optional
 
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.prompts import MessagesPlaceholder
+from langchain_core.runnables import RunnableWithMessageHistory
 
 from core.custom_llm import DeepSeekLLM
-from service.chat_history import chat_with_history_stream
+from service.chat_history import chat_with_history_stream, create_result_chain
 from service.retrieval_chain import initialize_retrieval_chain
-from service.vector_store import vector_store
+from service.vector_store import find_vector_store
 
 os.environ["OMP_NUM_THREADS"] = "1"
 
@@ -16,6 +18,16 @@ os.environ["OMP_NUM_THREADS"] = "1"
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# 🛠 配置部分
+LLM_MODEL = os.getenv("LLM_MODEL", "deepseek-r1:7b")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "http://192.168.64.1:11434")
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 3))  # 送入提示词的文档块数
+
+# 进程内共享的对话链，LLM、提示词和检索链只构建一次
+_chat_chain: Optional[RunnableWithMessageHistory] = None
+_llm: Optional[DeepSeekLLM] = None
+_chat_chain_lock = threading.Lock()
+
 
 def initialize_simple_chain(llm):
     """创建一个没有combine_docs_chain的简单检索链"""
@@ -39,41 +51,50 @@ def initialize_simple_chain(llm):
     return prompt_template | llm
 
 
-def _prepare_chat_runnable(file_path: Optional[str], user_id: str, session_id: str) -> Any:
+def get_chat_chain() -> RunnableWithMessageHistory:
     """
-    处理向量存储、文档加载及检索链（或备用 prompt）的初始化，
-    返回用于对话的 chat_runnable 对象
+    获取进程内共享的对话链，首次调用时构建 LLM、检索链及历史记录包装。
+
+    每次请求的 user_id/session_id/file_path 在调用时通过 config["configurable"] 绑定，不再重建链。
     """
-    try:
-        # 2. 初始化 LLM
-        model = DeepSeekLLM(
-            model="deepseek-r1:7b",
-            base_url="http://192.168.64.1:11434"
-        )
+    global _chat_chain, _llm
+    if _chat_chain is None:
+        with _chat_chain_lock:
+            if _chat_chain is None:
+                try:
+                    model = DeepSeekLLM(model=LLM_MODEL, base_url=LLM_BASE_URL)
+                    logger.info("创建检索链")
+                    retrieval_chain = initialize_retrieval_chain(model, RETRIEVAL_TOP_K, find_vector_store)
+                    _chat_chain = create_result_chain(retrieval_chain)
+                    _llm = model
+                except Exception as e:
+                    logger.exception("准备聊天链时出错：%s", e)
+                    raise
+    return _chat_chain
 
-        # 3. 创建检索链（如果向量存储存在），否则构造默认的 prompt 链
-        logger.info("创建检索链")
-        retrieval_chain = initialize_retrieval_chain(vector_store, model, 3, file_path, user_id, session_id)
-        return retrieval_chain
 
-    except Exception as e:
-        logger.exception("准备聊天链时出错：%s", e)
-        raise
+async def close_chat_chain():
+    """关闭 LLM 的连接池，应用退出时调用"""
+    if _llm is not None:
+        await _llm.aclose()
 
 
-def generate_stream(
+async def generate_stream(
         file_path: Optional[str],
         user_input: str,
         user_id: str,
         session_id: str,
+        timings: Optional[Dict[str, float]] = None,
 ) -> Any:
     """
-    主流程：流式输出
+    主流程：异步流式输出，timings 用于收集各阶段耗时
     """
     try:
-        chat_runnable = _prepare_chat_runnable(file_path=file_path, user_id=user_id, session_id=session_id)
+        chat_chain = get_chat_chain()
         logger.info("生成流式输出")
-        yield from chat_with_history_stream(chat_runnable, user_input, session_id, "retrieval")
+        async for item in chat_with_history_stream(chat_chain, user_input, session_id, "retrieval", timings,
+                                                   scope={"user_id": user_id, "file_path": file_path}):
+            yield item
     except Exception as e:
         logger.exception("生成流式结果时出错：%s", e)
         raise
@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+import chromadb
+from chromadb.config import Settings
+from chromadb.errors import InvalidCollectionException
+from langchain_chroma import Chroma
+
+# 配置日志
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 🛠 配置部分
+COLLECTION_SHARD_MODE = os.getenv("COLLECTION_SHARD_MODE", "user")  # 分片粒度：user / session
+MAX_OPEN_COLLECTIONS = int(os.getenv("MAX_OPEN_COLLECTIONS", 64))  # 同时保持打开的集合数
+COLLECTION_IDLE_SECONDS = int(os.getenv("COLLECTION_IDLE_SECONDS", 900))  # 集合空闲多久后关闭
+CHROMA_MEMORY_LIMIT_BYTES = int(os.getenv("CHROMA_MEMORY_LIMIT_BYTES", 2 * 1024 * 1024 * 1024))  # HNSW 索引内存上限
+LEGACY_COLLECTION_NAME = "langchain"  # 分片前所有用户共用的默认集合
+
+
+def create_chroma_client(persist_directory: str):
+    """创建持久化客户端，HNSW 索引按 LRU 策略在内存上限内加载/卸载"""
+    return chromadb.PersistentClient(
+        path=persist_directory,
+        settings=Settings(
+            anonymized_telemetry=False,
+            chroma_segment_cache_policy="LRU",
+            chroma_memory_limit_bytes=CHROMA_MEMORY_LIMIT_BYTES,
+        ),
+    )
+
+
+def _short_hash(value: str, length: int) -> str:
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()[:length]
+
+
+class CollectionRouter:
+    """
+    按租户把文档路由到独立的 Chroma 集合。
+
+    每个用户（或每个用户的每个会话）一个集合，查询只搜索租户自己的 HNSW 索引，
+    延迟只与租户自身的语料规模相关。集合按需打开，超过数量上限或长时间空闲的集合按 LRU 关闭。
+    """
+
+    def __init__(self, client, embedding_function, shard_mode: str = COLLECTION_SHARD_MODE,
+                 max_open: int = MAX_OPEN_COLLECTIONS, idle_seconds: int = COLLECTION_IDLE_SECONDS):
+        self.client = client
+        self.embedding_function = embedding_function
+        self.shard_mode = shard_mode
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self._open: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def collection_name(self, user_id: str, session_id: str) -> str:
+        # 集合名只允许 [a-zA-Z0-9._-]，使用哈希避免用户ID中的特殊字符
+        name = f"u_{_short_hash(user_id, 24)}"
+        if self.shard_mode == "session":
+            if not session_id:
+                raise ValueError("按会话分片（COLLECTION_SHARD_MODE=session）时必须提供 session_id")
+            name += f"_s_{_short_hash(session_id, 16)}"
+        return name
+
+    def get(self, user_id: str, session_id: str) -> Chroma:
+        """获取租户对应的向量库，不存在时自动创建（写入路径使用）"""
+        return self._open_store(self.collection_name(user_id, session_id), create=True)
+
+    def find(self, user_id: str, session_id: Optional[str]) -> Optional[Chroma]:
+        """只读获取租户对应的向量库，集合不存在时返回 None，不会为没有上传过文件的租户创建空集合"""
+        return self._open_store(self.collection_name(user_id, session_id), create=False)
+
+    def _exists(self, name: str) -> bool:
+        try:
+            self.client.get_collection(name)
+        except InvalidCollectionException:
+            return False
+        return True
+
+    def _open_store(self, name: str, create: bool) -> Optional[Chroma]:
+        now = time.monotonic()
+        with self._lock:
+            if name in self._open:
+                store, _ = self._open.pop(name)
+            else:
+                if not create and not self._exists(name):
+                    return None
+                store = Chroma(client=self.client, collection_name=name, embedding_function=self.embedding_function)
+                logger.info("打开租户集合：%s", name)
+            self._open[name] = (store, now)
+            self._evict(now)
+        return store
+
+    def _evict(self, now: float):
+        while self._open:
+            name, (_, last_used) = next(iter(self._open.items()))
+            if len(self._open) <= self.max_open and now - last_used < self.idle_seconds:
+                break
+            self._open.pop(name)
+            logger.info("关闭空闲集合：%s", name)
+
+    def migrate_legacy_collection(self, batch_size: int = 500,
+                                  on_batch: Optional[Callable[[List[str], List[dict], List[str]], None]] = None
+                                  ) -> bool:
+        """
+        把分片前的共享集合按 user_id/session_id 一次性迁移到各租户集合，完成后删除旧集合。
+        中途失败可重复执行：写入使用 upsert，旧集合只在全部迁移后删除。
+
+        :param on_batch: 每批写入租户集合后调用 on_batch(ids, metadatas, documents)，用于同步登记表等旁路索引
+        :return: 是否执行了迁移
+        """
+        if LEGACY_COLLECTION_NAME not in {collection.name if hasattr(collection, "name") else collection
+                                          for collection in self.client.list_collections()}:
+            return False
+        legacy = self.client.get_collection(LEGACY_COLLECTION_NAME)
+        total = legacy.count()
+        logger.info("开始迁移共享集合 %s，共 %d 条", LEGACY_COLLECTION_NAME, total)
+
+        for offset in range(0, total, batch_size):
+            page = legacy.get(limit=batch_size, offset=offset, include=["embeddings", "metadatas", "documents"])
+            groups = {}
+            for index, metadata in enumerate(page["metadatas"]):
+                key = (metadata.get("user_id", ""), metadata.get("session_id", ""))
+                groups.setdefault(key, []).append(index)
+            for (user_id, session_id), indexes in groups.items():
+                ids = [page["ids"][i] for i in indexes]
+                metadatas = [page["metadatas"][i] for i in indexes]
+                documents = [page["documents"][i] for i in indexes]
+                self.get(user_id, session_id)._collection.upsert(
+                    ids=ids,
+                    embeddings=[page["embeddings"][i] for i in indexes],
+                    metadatas=metadatas,
+                    documents=documents,
+                )
+                if on_batch:
+                    on_batch(ids, metadatas, documents)
+
+        self.client.delete_collection(LEGACY_COLLECTION_NAME)
+        logger.info("共享集合迁移完成，已删除 %s", LEGACY_COLLECTION_NAME)
+        return True
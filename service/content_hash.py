@@ -0,0 +1,27 @@
+import hashlib
+from collections import defaultdict
+from typing import Dict, List
+
+
+def hash_text(text: str) -> str:
+    """文本内容哈希（sha256）"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ChunkIdAllocator:
+    """
+    为同一文件的文档块分配确定性ID：相同作用域、相同内容的块总是得到相同的ID，
+    同一文件内重复出现的相同内容按出现次序区分。
+    """
+
+    def __init__(self, user_id: str, session_id: str, file_path: str):
+        self._scope = f"{user_id}\x1f{session_id}\x1f{file_path}"
+        self._occurrences: Dict[str, int] = defaultdict(int)
+
+    def allocate(self, chunk_hashes: List[str]) -> List[str]:
+        ids = []
+        for chunk_hash in chunk_hashes:
+            occurrence = self._occurrences[chunk_hash]
+            self._occurrences[chunk_hash] += 1
+            ids.append(hash_text(f"{self._scope}\x1f{chunk_hash}\x1f{occurrence}"))
+        return ids
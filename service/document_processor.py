@@ -7,7 +7,11 @@ from langchain_community.document_loaders import (
 )
 from langchain_text_splitters import MarkdownTextSplitter, RecursiveCharacterTextSplitter
 from langchain_unstructured import UnstructuredLoader
-from rapidocr_onnxruntime import RapidOCR
+
+from core.base.exception import ParseWorkerError
+from service.ocr_engine import IMAGE_EXTENSIONS, get_ocr_pool, load_image_frames, load_zip_images
+from service.parse_pool import PARSE_POOL_ENABLED, parse_engine
+from service.pdf_stream import needs_ocr, ocr_pdf_pages
 
 # 配置日志记录
 logging.basicConfig(level=logging.INFO)
@@ -18,6 +22,24 @@ logger = logging.getLogger(__name__)
 def load_and_split_document(file_path: str):
     """
     根据文件类型加载文档并拆分成多个 Document 对象
+
+    默认在按格式划分的解析进程池中执行，超时或子进程崩溃时抛出 ParseWorkerError，
+    不会拖垮 API 主进程。
+    """
+    if not PARSE_POOL_ENABLED:
+        return split_document_inline(file_path)
+    try:
+        return parse_engine.parse(file_path)
+    except ParseWorkerError:
+        raise
+    except Exception as e:
+        logger.exception("加载并拆分文档时出错：%s", e)
+        return []
+
+
+def split_document_inline(file_path: str):
+    """
+    在当前进程中根据文件类型加载文档并拆分，解析子进程内部也调用此函数
     """
     try:
         ext = os.path.splitext(file_path)[-1].lower()
@@ -31,8 +53,8 @@ def load_and_split_document(file_path: str):
             return load_word_splitter(file_path)
         elif ext == '.pdf':
             return load_pdf_splitter(file_path)
-        elif ext == '.jpg':
-            return load_jpg_splitter(file_path)
+        elif ext in IMAGE_EXTENSIONS or ext == '.zip':
+            return load_image_splitter(file_path)
         else:
             logger.error("不支持的文件类型：%s", ext)
             return []
@@ -81,31 +103,43 @@ def load_word_file(file_path: str) -> list:
 def load_pdf_file(file_path: str) -> list:
     try:
         logger.info("加载PDF文件：%s", file_path)
-        # 设置 OCR 相关环境变量
-        os.environ['OCR_AGENT'] = 'unstructured.partition.utils.ocr_models.tesseract_ocr.OCRAgentTesseract'
         loader = PyPDFLoader(file_path=file_path)
         docs = loader.load()
+
+        # 只对没有文本层的扫描页做栅格化 + OCR，文本页保持原有的快速抽取
+        ocr_texts = ocr_pdf_pages(file_path, [doc.metadata["page"] for doc in docs if needs_ocr(doc.page_content)])
+        for doc in docs:
+            doc.metadata["ocr"] = doc.metadata["page"] in ocr_texts
+            if doc.metadata["ocr"]:
+                doc.page_content = ocr_texts[doc.metadata["page"]]
         return docs
     except Exception as e:
         logger.exception("加载PDF文件时出错：%s", e)
         return []
 
 
-# 加载 JPG 文件（通过 OCR 识别）
-def load_jpg_file(file_path: str) -> str:
+# 加载图片文件（通过 OCR 识别），支持多帧 TIFF 及图片压缩包
+def load_image_file(file_path: str) -> list:
+    """
+    返回 [(文本, 元数据)]，每帧图片对应一项
+    """
     try:
-        logger.info("加载JPG文件：%s", file_path)
-        ocr = RapidOCR()
-        result, _ = ocr(file_path)
-        if result:
-            ocr_result = [line[1] for line in result]
-            return "\n".join(ocr_result)
+        logger.info("加载图片文件：%s", file_path)
+        if file_path.lower().endswith('.zip'):
+            entries = [({"source": file_path, "image": name, "page": frame_no}, image)
+                       for name, frame_no, image in load_zip_images(file_path)]
         else:
-            logger.warning("JPG文件OCR未返回结果：%s", file_path)
-            return ""
+            entries = [({"source": file_path, "page": frame_no}, image)
+                       for frame_no, image in enumerate(load_image_frames(file_path))]
+
+        results = get_ocr_pool().ocr_batch([image for _, image in entries])
+        texts = [(result.text, metadata) for (metadata, _), result in zip(entries, results) if result.text]
+        if not texts:
+            logger.warning("图片文件OCR未返回结果：%s", file_path)
+        return texts
     except Exception as e:
-        logger.exception("加载JPG文件时出错：%s", e)
-        return ""
+        logger.exception("加载图片文件时出错：%s", e)
+        return []
 
 
 # 预处理文本（例如：转换小写、去除标点等）
@@ -172,15 +206,16 @@ def load_pdf_splitter(pdf_file: str, chunk_size=200, chunk_overlap=20):
         return []
 
 
-# 分割 JPG 文件（OCR后处理）
-def load_jpg_splitter(jpg_file: str, chunk_size=200, chunk_overlap=20):
+# 分割图片文件（OCR后处理）
+def load_image_splitter(image_file: str, chunk_size=200, chunk_overlap=20):
     try:
-        logger.info("拆分JPG文件：%s", jpg_file)
-        docs = load_jpg_file(jpg_file)
+        logger.info("拆分图片文件：%s", image_file)
+        texts = load_image_file(image_file)
         text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
         # 因为 OCR 返回的是字符串，所以使用 create_documents 将文本转换成 Document 对象
-        split_docs = text_splitter.create_documents([docs])
+        split_docs = text_splitter.create_documents([text for text, _ in texts],
+                                                    metadatas=[metadata for _, metadata in texts])
         return split_docs
     except Exception as e:
-        logger.exception("拆分JPG文件时出错：%s", e)
+        logger.exception("拆分图片文件时出错：%s", e)
         return []
@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# 配置日志
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 🛠 配置部分
+EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float32")  # 磁盘向量精度：float32 / float16
+EMBEDDING_CACHE_LRU_SIZE = int(os.getenv("EMBEDDING_CACHE_LRU_SIZE", 20000))  # 内存 LRU 缓存的向量条数（以 float32 数组保存，1024 维约 4KB/条）
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    带磁盘持久化的向量缓存，包装任意 Embeddings 实现。
+
+    缓存键为 (模型名, 是否归一化, 文本哈希)。向量以定长记录追加写入内存映射文件，
+    键到行号的索引保存在同目录的 SQLite 中，上层再加一层内存 LRU。
+    LRU 中的向量保存为 float32 数组而不是 Python 浮点列表，只在返回给调用方时才转换为列表。
+    向量文件与索引按磁盘精度成对命名（vectors.{dtype} / index.{dtype}.sqlite3），切换精度后互不干扰。
+    重复的问题和重复上传的文档可以完全跳过模型推理。
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, normalize: bool, cache_dir: str,
+                 dtype: str = EMBEDDING_CACHE_DTYPE, lru_size: int = EMBEDDING_CACHE_LRU_SIZE):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.normalize = normalize
+        self.dtype = np.dtype(dtype)
+        self.lru_size = lru_size
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._vectors_path = os.path.join(cache_dir, f"vectors.{self.dtype.name}")
+        # 索引中的行号只对同一精度的向量文件有效，因此索引库也按精度区分
+        index_path = os.path.join(cache_dir, f"index.{self.dtype.name}.sqlite3")
+        self._conn = sqlite3.connect(index_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL;')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS embedding_index (key TEXT PRIMARY KEY, row INTEGER NOT NULL);')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS embedding_meta (name TEXT PRIMARY KEY, value TEXT);')
+        self._dim: Optional[int] = None
+        self._load_dim()
+
+        # 磁盘锁保护共享的 SQLite 连接和内存映射，可能被写事务长时间持有；
+        # LRU 锁只保护内存字典和计数器，持有时间极短，可以在事件循环上直接获取
+        self._disk_lock = threading.Lock()
+        self._lru_lock = threading.Lock()
+        self._mmap: Optional[np.memmap] = None
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> str:
+        raw = f"{self.model_name}\x1f{int(self.normalize)}\x1f{text}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _load_dim(self):
+        row = self._conn.execute("SELECT value FROM embedding_meta WHERE name = 'dim'").fetchone()
+        if row:
+            self._dim = int(row[0])
+
+    # ---------- 内存 LRU ----------
+    def _lru_get(self, key: str) -> Optional[np.ndarray]:
+        vector = self._lru.get(key)
+        if vector is not None:
+            self._lru.move_to_end(key)
+        return vector
+
+    def _lru_put(self, key: str, vector: np.ndarray):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    # ---------- 磁盘存储 ----------
+    def _read_rows(self, rows: List[int]) -> np.ndarray:
+        """读取指定行的向量，其他进程追加写入后自动重新映射文件"""
+        if self._mmap is None or max(rows) >= self._mmap.shape[0]:
+            total_rows = os.path.getsize(self._vectors_path) // (self.dtype.itemsize * self._dim)
+            self._mmap = np.memmap(self._vectors_path, dtype=self.dtype, mode='r', shape=(total_rows, self._dim))
+        return np.asarray(self._mmap[rows], dtype=np.float32)
+
+    def _disk_get(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if self._dim is None:
+            self._load_dim()
+        if self._dim is None or not keys:
+            return {}
+        found = {}
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            found.update(self._conn.execute(
+                f'SELECT key, row FROM embedding_index WHERE key IN ({", ".join("?" * len(part))})', part
+            ).fetchall())
+        if not found:
+            return {}
+        vectors = self._read_rows(list(found.values()))
+        return dict(zip(found.keys(), vectors))
+
+    def _disk_put(self, items: Dict[str, np.ndarray]):
+        """在 SQLite 写事务内追加向量，保证多进程同时写入时行号不冲突"""
+        if not items:
+            return
+        matrix = np.asarray(list(items.values()), dtype=self.dtype)
+        self._conn.execute('BEGIN IMMEDIATE;')
+        try:
+            self._load_dim()
+            if self._dim is None:
+                self._dim = matrix.shape[1]
+                self._conn.execute("INSERT OR REPLACE INTO embedding_meta (name, value) VALUES ('dim', ?)",
+                                   (str(self._dim),))
+            with open(self._vectors_path, 'ab') as fp:
+                first_row = fp.tell() // (self.dtype.itemsize * self._dim)
+                fp.write(matrix.tobytes())
+            self._conn.executemany('INSERT OR IGNORE INTO embedding_index (key, row) VALUES (?, ?)',
+                                   [(key, first_row + offset) for offset, key in enumerate(items)])
+            self._conn.execute('COMMIT;')
+        except BaseException:
+            self._conn.execute('ROLLBACK;')
+            raise
+
+    # ---------- Embeddings 接口 ----------
+    def _embed(self, texts: List[str], embed_missing) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        results: Dict[str, np.ndarray] = {}
+
+        with self._lru_lock:
+            for key in keys:
+                vector = self._lru_get(key)
+                if vector is not None:
+                    results[key] = vector
+            memory_hits = len(results)
+
+        pending = list(dict.fromkeys(key for key in keys if key not in results))
+        with self._disk_lock:
+            from_disk = self._disk_get(pending)
+        with self._lru_lock:
+            for key, vector in from_disk.items():
+                self._lru_put(key, vector)
+        results.update(from_disk)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in results:
+                missing.setdefault(key, text)
+        if missing:
+            vectors = np.asarray(embed_missing(list(missing.values())), dtype=np.float32)
+            computed = dict(zip(missing.keys(), vectors))
+            with self._disk_lock:
+                self._disk_put(computed)
+            with self._lru_lock:
+                for key, vector in computed.items():
+                    self._lru_put(key, vector)
+            results.update(computed)
+
+        with self._lru_lock:
+            self.hits += memory_hits
+            self.disk_hits += len(from_disk)
+            self.misses += len(missing)
+        return [results[key].tolist() for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], lambda missing: [self.embeddings.embed_query(missing[0])])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        异步查询向量：内存命中直接返回，磁盘读写放到线程池，模型推理等待内层异步接口。
+        事件循环上只获取短时持有的 LRU 锁，不会被入库线程的磁盘写事务阻塞。
+        """
+        key = self._key(text)
+        with self._lru_lock:
+            vector = self._lru_get(key)
+            if vector is not None:
+                self.hits += 1
+                return vector.tolist()
+
+        def disk_get():
+            with self._disk_lock:
+                return self._disk_get([key]).get(key)
+
+        vector = await asyncio.to_thread(disk_get)
+        if vector is not None:
+            with self._lru_lock:
+                self._lru_put(key, vector)
+                self.disk_hits += 1
+            return vector.tolist()
+
+        vector = np.asarray(await self.embeddings.aembed_query(text), dtype=np.float32)
+
+        def disk_put():
+            with self._disk_lock:
+                self._disk_put({key: vector})
+
+        await asyncio.to_thread(disk_put)
+        with self._lru_lock:
+            self._lru_put(key, vector)
+            self.misses += 1
+        return vector.tolist()
+
+    def stats(self) -> dict:
+        """缓存命中统计：hits 为内存命中，disk_hits 为磁盘命中，misses 为实际调用模型的文本数"""
+        with self._lru_lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / total, 4) if total else 0.0,
+                "lru_entries": len(self._lru),
+            }
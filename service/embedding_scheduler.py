@@ -0,0 +1,166 @@
+import asyncio
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+# 配置日志
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 🛠 配置部分
+EMBED_MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE", 32))  # 单次前向计算的最大文本数
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", 5))  # 攒批的最长等待时间（毫秒）
+
+# 队列优先级：数值越小越先出队
+_PRIORITY_QUERY = 0
+_PRIORITY_BULK = 1
+
+
+@dataclass
+class _EmbedRequest:
+    texts: List[str]
+    priority: int = _PRIORITY_BULK
+    future: Future = field(default_factory=Future)
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    进程内的向量化调度器，包装任意 Embeddings 实现。
+
+    所有请求的 embed_query / embed_documents 调用进入同一个优先队列，由后台线程按
+    max_batch_size / max_wait_ms 攒成微批次，按文本长度排序以减少 padding 后统一前向计算，
+    再把结果分发回各自的 Future。并发检索时多个小请求合并为一次前向，降低尾延迟和总 CPU。
+
+    查询走高优先级通道，总是先于入库文本出队；入库文本按 max_batch_size 拆成多段分别排队，
+    每个微批次不超过一次前向计算，因此入库期间查询最多等待一个正在进行的前向批次。
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int = EMBED_MAX_BATCH_SIZE,
+                 max_wait_ms: float = EMBED_MAX_WAIT_MS):
+        self.embeddings = embeddings
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        # 元素为 (优先级, 入队序号, 请求)，同优先级按入队顺序出队
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._loop, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def _put(self, request: _EmbedRequest):
+        self._queue.put((request.priority, next(self._seq), request))
+
+    def submit(self, texts: List[str], priority: int = _PRIORITY_BULK) -> Future:
+        """提交一组文本，返回结果为向量列表的 Future；超过 max_batch_size 的文本拆段排队"""
+        texts = list(texts)
+        future: Future = Future()
+        if not texts:
+            future.set_result([])
+            return future
+        self._ensure_worker()
+
+        parts = [_EmbedRequest(texts=texts[start:start + self.max_batch_size], priority=priority)
+                 for start in range(0, len(texts), self.max_batch_size)]
+        if len(parts) == 1:
+            self._put(parts[0])
+            return parts[0].future
+
+        # 各分段都由后台线程依次完成，回调串行执行，无需额外加锁
+        results: List[Optional[List[List[float]]]] = [None] * len(parts)
+        remaining = [len(parts)]
+
+        def on_part_done(part_no: int, part_future: Future):
+            if future.done():
+                return
+            error = part_future.exception()
+            if error is not None:
+                future.set_exception(error)
+                return
+            results[part_no] = part_future.result()
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                future.set_result([vector for part in results for vector in part])
+
+        for part_no, part in enumerate(parts):
+            part.future.add_done_callback(lambda f, no=part_no: on_part_done(no, f))
+            self._put(part)
+        return future
+
+    def _collect(self) -> List[_EmbedRequest]:
+        """
+        阻塞等待第一个请求，然后在 max_wait 内继续攒批，总文本数不超过 max_batch_size。
+        放不下的请求按原序号放回队列，下一轮仍按优先级先出队。
+        """
+        _, _, first = self._queue.get()
+        batch = [first]
+        size = len(first.texts)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                priority, seq, request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if size + len(request.texts) > self.max_batch_size:
+                self._queue.put((priority, seq, request))
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _run(self, batch: List[_EmbedRequest]):
+        # (请求序号, 文本序号, 文本)，按长度排序后切成不超过 max_batch_size 的前向批次
+        items = sorted(((req_no, text_no, text)
+                        for req_no, request in enumerate(batch)
+                        for text_no, text in enumerate(request.texts)),
+                       key=lambda item: len(item[2]))
+        results = [[None] * len(request.texts) for request in batch]
+        try:
+            for start in range(0, len(items), self.max_batch_size):
+                part = items[start:start + self.max_batch_size]
+                vectors = self.embeddings.embed_documents([text for _, _, text in part])
+                for (req_no, text_no, _), vector in zip(part, vectors):
+                    results[req_no][text_no] = vector
+        except Exception as e:
+            logger.exception("批量向量化失败：%s", e)
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        for request, vectors in zip(batch, results):
+            request.future.set_result(vectors)
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            start = time.perf_counter()
+            self._run(batch)
+            logger.debug("微批次向量化：%d 个请求, %d 条文本, 耗时 %.1fms",
+                         len(batch), sum(len(r.texts) for r in batch), (time.perf_counter() - start) * 1000)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.submit(texts).result()
+
+    def embed_query(self, text: str) -> List[float]:
+        # bge 的查询与文档编码参数一致（未配置查询指令），可与文档合并在同一批次
+        return self.submit([text], priority=_PRIORITY_QUERY).result()[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.wrap_future(self.submit(texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await asyncio.wrap_future(self.submit([text], priority=_PRIORITY_QUERY)))[0]
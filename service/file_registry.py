@@ -0,0 +1,197 @@
+import os
+import sqlite3
+import time
+from typing import List, Optional
+
+# 文件登记表与 Chroma 使用同一个 SQLite 文件
+current_path = os.path.abspath(__file__)
+parent_path = os.path.dirname(os.path.dirname(current_path))
+db_path = f'{parent_path}/chroma_db/chroma.sqlite3'
+
+# 文件状态
+FILE_STATUS_INGESTING = "ingesting"
+FILE_STATUS_DONE = "done"
+FILE_STATUS_FAILED = "failed"
+
+
+def _connect():
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def init_file_registry():
+    conn = _connect()
+    conn.executescript('''
+    CREATE TABLE IF NOT EXISTS uploaded_files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        session_id TEXT NOT NULL,
+        file_path TEXT NOT NULL,
+        file_name TEXT NOT NULL,
+        upload_order INTEGER NOT NULL,
+        size INTEGER,
+        file_hash TEXT,
+        chunk_count INTEGER,
+        status TEXT NOT NULL,
+        parse_ms INTEGER,
+        embed_ms INTEGER,
+        chunks_per_s REAL,
+        committed_chunks INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        UNIQUE (user_id, session_id, file_path)
+    );
+    CREATE INDEX IF NOT EXISTS idx_uploaded_files_hash ON uploaded_files (file_hash, status);
+    CREATE INDEX IF NOT EXISTS idx_uploaded_files_session ON uploaded_files (session_id, file_path);
+
+    -- 每个会话一行的上传顺序计数器
+    CREATE TABLE IF NOT EXISTS file_upload_counters (
+        user_id TEXT NOT NULL,
+        session_id TEXT NOT NULL,
+        last_order INTEGER NOT NULL,
+        PRIMARY KEY (user_id, session_id)
+    );
+
+    -- 一次性回填等迁移步骤的完成标记
+    CREATE TABLE IF NOT EXISTS file_registry_meta (
+        name TEXT PRIMARY KEY,
+        value TEXT
+    );
+    ''')
+    # 兼容旧版本创建的表：补齐批量写入断点与吞吐字段
+    columns = {row["name"] for row in conn.execute('PRAGMA table_info(uploaded_files);')}
+    if "chunks_per_s" not in columns:
+        conn.execute('ALTER TABLE uploaded_files ADD COLUMN chunks_per_s REAL;')
+    if "committed_chunks" not in columns:
+        conn.execute('ALTER TABLE uploaded_files ADD COLUMN committed_chunks INTEGER NOT NULL DEFAULT 0;')
+    conn.commit()
+    conn.close()
+
+
+def _allocate_upload_order(conn, user_id: str, session_id: str) -> int:
+    """原子地递增会话计数器并返回新的上传顺序，O(1)"""
+    return conn.execute('''
+    INSERT INTO file_upload_counters (user_id, session_id, last_order) VALUES (?, ?, 1)
+    ON CONFLICT (user_id, session_id) DO UPDATE SET last_order = last_order + 1
+    RETURNING last_order;
+    ''', (user_id, session_id)).fetchone()[0]
+
+
+def get_file(user_id: str, session_id: str, file_path: str) -> Optional[dict]:
+    conn = _connect()
+    row = conn.execute('SELECT * FROM uploaded_files WHERE user_id = ? AND session_id = ? AND file_path = ?',
+                       (user_id, session_id, file_path)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def find_session_file(session_id: str, file_path: str) -> Optional[dict]:
+    conn = _connect()
+    row = conn.execute('SELECT * FROM uploaded_files WHERE session_id = ? AND file_path = ?',
+                       (session_id, file_path)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def find_file_by_hash(file_hash: str) -> Optional[dict]:
+    """查找任意一个已成功入库、内容相同的文件"""
+    conn = _connect()
+    row = conn.execute('SELECT * FROM uploaded_files WHERE file_hash = ? AND status = ? LIMIT 1',
+                       (file_hash, FILE_STATUS_DONE)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def list_files(user_id: str, session_id: str) -> List[dict]:
+    conn = _connect()
+    rows = conn.execute('''
+    SELECT file_name, file_path, upload_order, size, file_hash, chunk_count, status, parse_ms, embed_ms,
+           chunks_per_s, created_at, updated_at
+    FROM uploaded_files WHERE user_id = ? AND session_id = ? ORDER BY upload_order
+    ''', (user_id, session_id)).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def register_file(user_id: str, session_id: str, file_path: str, size: int, file_hash: Optional[str]) -> dict:
+    """
+    登记一次文件上传。新文件分配下一个上传顺序，同名文件重新上传时保留原有顺序。
+    """
+    now = time.time()
+    conn = _connect()
+    with conn:
+        # UPDATE 开启写事务并持有写锁，同一路径的并发登记在此串行化
+        record = conn.execute('''
+        UPDATE uploaded_files SET size = ?, file_hash = ?, status = ?, updated_at = ?
+        WHERE user_id = ? AND session_id = ? AND file_path = ?
+        RETURNING *
+        ''', (size, file_hash, FILE_STATUS_INGESTING, now, user_id, session_id, file_path)).fetchall()
+        if not record:
+            record = conn.execute('''
+            INSERT INTO uploaded_files
+            (user_id, session_id, file_path, file_name, upload_order, size, file_hash, status, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, session_id, file_path) DO UPDATE SET
+                size = excluded.size, file_hash = excluded.file_hash, status = excluded.status,
+                updated_at = excluded.updated_at
+            RETURNING *
+            ''', (user_id, session_id, file_path, os.path.basename(file_path),
+                  _allocate_upload_order(conn, user_id, session_id), size, file_hash, FILE_STATUS_INGESTING,
+                  now, now)).fetchall()
+    conn.close()
+    return dict(record[0])
+
+
+def register_existing_files(files: List[dict]):
+    """
+    登记登记表建立之前已入库的文件（由向量库中的块元数据汇总而来），已登记的文件保持不变。
+    每项包含 user_id、session_id、file_path、upload_order、chunk_count、file_hash，
+    并把会话的上传顺序计数器推进到不小于已有的最大顺序。
+    """
+    if not files:
+        return
+    now = time.time()
+    conn = _connect()
+    with conn:
+        conn.executemany('''
+        INSERT INTO uploaded_files
+        (user_id, session_id, file_path, file_name, upload_order, file_hash, chunk_count, committed_chunks, status,
+         created_at, updated_at)
+        VALUES (:user_id, :session_id, :file_path, :file_name, :upload_order, :file_hash, :chunk_count, :chunk_count,
+                :status, :now, :now)
+        ON CONFLICT (user_id, session_id, file_path) DO NOTHING
+        ''', [{**item, "file_name": os.path.basename(item["file_path"]), "status": FILE_STATUS_DONE, "now": now}
+              for item in files])
+        conn.executemany('''
+        INSERT INTO file_upload_counters (user_id, session_id, last_order) VALUES (:user_id, :session_id, :upload_order)
+        ON CONFLICT (user_id, session_id) DO UPDATE SET last_order = MAX(last_order, excluded.last_order)
+        ''', files)
+    conn.close()
+
+
+def get_meta(name: str) -> Optional[str]:
+    conn = _connect()
+    row = conn.execute('SELECT value FROM file_registry_meta WHERE name = ?', (name,)).fetchone()
+    conn.close()
+    return row["value"] if row else None
+
+
+def set_meta(name: str, value: str):
+    conn = _connect()
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO file_registry_meta (name, value) VALUES (?, ?)', (name, value))
+    conn.close()
+
+
+def update_file(file_id: int, **fields):
+    """更新文件的入库结果（chunk_count、status、parse_ms、embed_ms、committed_chunks 等）"""
+    fields["updated_at"] = time.time()
+    columns = ", ".join(f"{key} = ?" for key in fields)
+    conn = _connect()
+    with conn:
+        conn.execute(f'UPDATE uploaded_files SET {columns} WHERE id = ?', (*fields.values(), file_id))
+    conn.close()
+
+
+init_file_registry()
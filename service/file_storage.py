@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.base.exception import FileTooLargeError, ResponseModel
+
+# 配置日志
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 🛠 配置部分
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 500 * 1024 * 1024))  # 单文件最大字节数
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))  # 每次读取/写入的块大小
+UPLOAD_FORM_OVERHEAD = int(os.getenv("UPLOAD_FORM_OVERHEAD", 1024 * 1024))  # 请求体中表单字段和分隔符的额外字节
+
+
+@dataclass
+class StoredFile:
+    """落盘后的上传文件信息"""
+    path: str
+    size: int
+    sha256: str
+
+
+class UploadSizeLimitMiddleware:
+    """
+    在表单解析之前限制上传接口的请求体大小。
+
+    Starlette 会在调用接口之前把整个 multipart 请求体读完并缓存，接口内的校验只能在接收完成后生效，
+    因此在 ASGI 层：Content-Length 超限时不读取请求体直接拒绝；否则统计实际收到的字节数，
+    超限时中断接收并返回 413，丢弃解析中断产生的错误响应。
+    """
+
+    def __init__(self, app: ASGIApp, path_prefix: str = "/file/upload",
+                 max_size: int = MAX_UPLOAD_SIZE, form_overhead: int = UPLOAD_FORM_OVERHEAD):
+        self.app = app
+        self.path_prefix = path_prefix
+        self.max_size = max_size
+        self.max_body_size = max_size + form_overhead
+
+    async def _reject(self, scope: Scope, receive: Receive, send: Send):
+        error = FileTooLargeError(self.max_size)
+        logger.warning("上传请求体超过限制，已拒绝：%s", scope.get("path"))
+        response = JSONResponse(ResponseModel(message=str(error), code=413).model_dump(), status_code=413,
+                                headers={"Connection": "close"})
+        await response(scope, receive, send)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length", "")
+        if content_length.isdigit() and int(content_length) > self.max_body_size:
+            await self._reject(scope, receive, send)
+            return
+
+        # 分块传输或 Content-Length 不可信时，按实际收到的字节数中断
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    exceeded = True
+                    raise FileTooLargeError(self.max_size)
+            return message
+
+        async def guarded_send(message: Message):
+            nonlocal response_started
+            if exceeded and not response_started:
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except FileTooLargeError:
+            pass
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not response_started:
+            await self._reject(scope, receive, send)
+
+
+async def save_upload_stream(file: UploadFile, dest_path: str,
+                             max_size: int = MAX_UPLOAD_SIZE,
+                             chunk_size: int = UPLOAD_CHUNK_SIZE) -> StoredFile:
+    """
+    按固定大小的块把上传文件写入磁盘，同时计算 sha256。
+
+    请求体大小已由 UploadSizeLimitMiddleware 在接收阶段限制，这里再按文件实际字节数校验，
+    超过 max_size 时中止并删除已写入的临时文件。磁盘写入在线程池中执行，不阻塞事件循环；
+    写入先落到同目录下唯一命名的 .part 临时文件，完成后原子替换为目标文件，
+    同名文件并发上传时互不覆盖。
+    """
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path),
+                                    prefix=f"{os.path.basename(dest_path)}.", suffix=".part")
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            while True:
+                block = await file.read(chunk_size)
+                if not block:
+                    break
+                size += len(block)
+                if size > max_size:
+                    raise FileTooLargeError(max_size)
+                digest.update(block)
+                await asyncio.to_thread(fp.write, block)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        # 超限、客户端断开或写入失败时清理半成品文件
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        await file.close()
+
+    logger.info("文件已写入：%s, 大小：%d 字节, sha256：%s", dest_path, size, digest.hexdigest())
+    return StoredFile(path=dest_path, size=size, sha256=digest.hexdigest())
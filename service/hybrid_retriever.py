@@ -0,0 +1,78 @@
+import asyncio
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from service.keyword_index import KeywordIndex
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    向量检索与 BM25 关键词检索的混合检索器，两路结果按倒数排名融合（RRF）后取前 k 个。
+
+    合同编号、人名、条款号等精确词命中依赖关键词检索，语义相近的表述依赖向量检索。
+    """
+
+    vector_store: Any
+    """租户对应的 Chroma 向量库"""
+
+    keyword_index: KeywordIndex
+    """本地倒排索引"""
+
+    user_id: str
+    session_id: Optional[str] = None
+    file_path: Optional[str] = None
+
+    k: int = 3
+    """最终返回的文档数"""
+
+    fetch_k: int = 20
+    """每一路检索召回的候选数"""
+
+    rrf_k: int = 60
+    """RRF 平滑常数"""
+
+    def _vector_filter(self) -> dict:
+        conditions = [{"user_id": self.user_id}]
+        if self.session_id:
+            conditions.append({"session_id": self.session_id})
+        if self.file_path:
+            conditions.append({"file_path": self.file_path})
+        return {"$and": conditions} if len(conditions) > 1 else conditions[0]
+
+    def _keyword_search(self, query: str) -> List[dict]:
+        return self.keyword_index.search(query, user_id=self.user_id, session_id=self.session_id,
+                                         file_path=self.file_path, k=self.fetch_k)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        dense = self.vector_store.similarity_search(query, k=self.fetch_k, filter=self._vector_filter())
+        sparse = self._keyword_search(query)
+        return self._fuse(dense, sparse)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        # 查询向量走异步接口（可与其他请求合并批次），Chroma 与 SQLite 检索放到线程池并行执行
+        embedding = await self.vector_store.embeddings.aembed_query(query)
+        dense, sparse = await asyncio.gather(
+            asyncio.to_thread(self.vector_store.similarity_search_by_vector, embedding,
+                              k=self.fetch_k, filter=self._vector_filter()),
+            asyncio.to_thread(self._keyword_search, query),
+        )
+        return self._fuse(dense, sparse)
+
+    def _fuse(self, dense: List[Document], sparse: List[dict]) -> List[Document]:
+        scores = {}
+        documents = {}
+        for rank, doc in enumerate(dense):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1 / (self.rrf_k + rank + 1)
+            documents.setdefault(key, doc)
+        for rank, hit in enumerate(sparse):
+            key = hit["chunk_id"]
+            scores[key] = scores.get(key, 0.0) + 1 / (self.rrf_k + rank + 1)
+            documents.setdefault(key, Document(id=key, page_content=hit["content"], metadata=hit["metadata"]))
+
+        ranked = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        return [documents[key] for key in ranked]
@@ -0,0 +1,220 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+from core.base.exception import IngestionSupersededError
+from service.parse_pool import POOL_SIZES
+from service.vector_store import upload_file
+
+# 配置日志
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 任务状态保存在 Chroma 同一个 SQLite 文件中，服务重启后可恢复
+current_path = os.path.abspath(__file__)
+parent_path = os.path.dirname(os.path.dirname(current_path))
+db_path = f'{parent_path}/chroma_db/chroma.sqlite3'
+
+# 🛠 配置部分
+# 后台解析/向量化的工作线程数。每个线程同一时刻只解析一个文件，默认与解析进程总数一致，
+# 多个文件同时入库时各格式的解析进程池都能被占满
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", sum(POOL_SIZES.values())))
+
+# 任务状态
+STATUS_QUEUED = "queued"
+STATUS_PARSING = "parsing"
+STATUS_EMBEDDING = "embedding"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_SUPERSEDED = "superseded"  # 同一文件有更新的任务，本任务已停止
+UNFINISHED_STATUSES = (STATUS_QUEUED, STATUS_PARSING, STATUS_EMBEDDING)
+
+
+def _connect():
+    return sqlite3.connect(db_path, timeout=30)
+
+
+def init_ingestion_jobs():
+    conn = _connect()
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS ingestion_jobs (
+        job_id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        session_id TEXT NOT NULL,
+        file_path TEXT NOT NULL,
+        file_hash TEXT,
+        status TEXT NOT NULL,
+        error TEXT,
+        chunk_count INTEGER,
+        chunks_per_s REAL,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        parsed_at REAL,
+        finished_at REAL
+    );
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs (status);')
+    # 兼容旧版本创建的表：补齐吞吐字段
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(ingestion_jobs);')}
+    if "chunks_per_s" not in columns:
+        conn.execute('ALTER TABLE ingestion_jobs ADD COLUMN chunks_per_s REAL;')
+    conn.commit()
+    conn.close()
+
+
+def _update_job(job_id: str, **fields):
+    columns = ", ".join(f"{key} = ?" for key in fields)
+    conn = _connect()
+    conn.execute(f'UPDATE ingestion_jobs SET {columns} WHERE job_id = ?', (*fields.values(), job_id))
+    conn.commit()
+    conn.close()
+
+
+def _format_ts(ts: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(ts).isoformat(timespec='milliseconds') if ts else None
+
+
+def _elapsed_ms(start: Optional[float], end: Optional[float]) -> Optional[int]:
+    return int((end - start) * 1000) if start and end else None
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    """查询任务状态及各阶段耗时（毫秒）"""
+    conn = _connect()
+    conn.row_factory = sqlite3.Row
+    row = conn.execute('SELECT * FROM ingestion_jobs WHERE job_id = ?', (job_id,)).fetchone()
+    conn.close()
+    if row is None:
+        return None
+
+    return {
+        "job_id": row["job_id"],
+        "user_id": row["user_id"],
+        "session_id": row["session_id"],
+        "file_path": row["file_path"],
+        "status": row["status"],
+        "error": row["error"],
+        "chunk_count": row["chunk_count"],
+        "chunks_per_s": row["chunks_per_s"],
+        "created_at": _format_ts(row["created_at"]),
+        "started_at": _format_ts(row["started_at"]),
+        "finished_at": _format_ts(row["finished_at"]),
+        "timings": {
+            "queue_ms": _elapsed_ms(row["created_at"], row["started_at"]),
+            "parse_ms": _elapsed_ms(row["started_at"], row["parsed_at"]),
+            "embed_ms": _elapsed_ms(row["parsed_at"], row["finished_at"]),
+            "total_ms": _elapsed_ms(row["created_at"], row["finished_at"]),
+        },
+    }
+
+
+class IngestionQueue:
+    """
+    后台文档入库队列：上传接口只负责登记任务，解析与向量化在工作线程池中执行，
+    不再阻塞事件循环。
+
+    同一文件（user_id, session_id, file_path）只有最新提交的任务有效：重新上传后，
+    仍在执行的旧任务在下一个批次前停止，排队中的旧任务直接跳过。
+    """
+
+    def __init__(self, max_workers: int = INGEST_WORKERS):
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        # (user_id, session_id, file_path) -> 最新提交的任务ID
+        self._latest_jobs = {}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ingest")
+            return self._executor
+
+    def submit(self, file_path: str, user_id: str, session_id: str, file_hash: Optional[str] = None) -> str:
+        """登记一个入库任务并立即返回任务ID"""
+        job_id = uuid.uuid4().hex
+        conn = _connect()
+        conn.execute('''
+        INSERT INTO ingestion_jobs (job_id, user_id, session_id, file_path, file_hash, status, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (job_id, user_id, session_id, file_path, file_hash, STATUS_QUEUED, time.time()))
+        conn.commit()
+        conn.close()
+
+        self._schedule(job_id, file_path, user_id, session_id, file_hash)
+        logger.info("入库任务已排队：job_id=%s, file=%s", job_id, file_path)
+        return job_id
+
+    def _schedule(self, job_id: str, file_path: str, user_id: str, session_id: str, file_hash: Optional[str]):
+        with self._lock:
+            self._latest_jobs[(user_id, session_id, file_path)] = job_id
+        self._get_executor().submit(self._run, job_id, file_path, user_id, session_id, file_hash)
+
+    def _run(self, job_id: str, file_path: str, user_id: str, session_id: str, file_hash: Optional[str]):
+        key = (user_id, session_id, file_path)
+
+        def is_superseded() -> bool:
+            return self._latest_jobs.get(key) != job_id
+
+        def on_stage(stage: str, chunk_count: Optional[int] = None, chunks_per_s: Optional[float] = None, **_):
+            if stage == "parsing":
+                _update_job(job_id, status=STATUS_PARSING, started_at=time.time())
+            elif stage == "embedding":
+                # 流式解析时 parsed_at 表示首批文档块就绪的时间
+                _update_job(job_id, status=STATUS_EMBEDDING, parsed_at=time.time(), chunk_count=chunk_count)
+            elif stage == "progress":
+                # 每个批次提交后上报已写入块数与吞吐
+                _update_job(job_id, chunk_count=chunk_count, chunks_per_s=chunks_per_s)
+
+        try:
+            chunk_count = upload_file(file_path=file_path, user_id=user_id, session_id=session_id,
+                                      file_hash=file_hash, on_stage=on_stage, is_superseded=is_superseded)
+            _update_job(job_id, status=STATUS_DONE, chunk_count=chunk_count, finished_at=time.time())
+            logger.info("入库任务完成：job_id=%s, chunks=%d", job_id, chunk_count)
+        except IngestionSupersededError as e:
+            logger.info("入库任务已被取代：job_id=%s, %s", job_id, e)
+            _update_job(job_id, status=STATUS_SUPERSEDED, error=str(e), finished_at=time.time())
+        except Exception as e:
+            logger.exception("入库任务失败：job_id=%s, %s", job_id, e)
+            _update_job(job_id, status=STATUS_FAILED, error=str(e), finished_at=time.time())
+        finally:
+            with self._lock:
+                if self._latest_jobs.get(key) == job_id:
+                    del self._latest_jobs[key]
+
+    def recover(self):
+        """服务启动时重新调度上次未完成的任务"""
+        conn = _connect()
+        rows = conn.execute(
+            f'SELECT job_id, file_path, user_id, session_id, file_hash FROM ingestion_jobs '
+            f'WHERE status IN ({", ".join("?" * len(UNFINISHED_STATUSES))}) ORDER BY created_at',
+            UNFINISHED_STATUSES,
+        ).fetchall()
+        conn.close()
+
+        for job_id, file_path, user_id, session_id, file_hash in rows:
+            if not os.path.exists(file_path):
+                _update_job(job_id, status=STATUS_FAILED, error="文件不存在", finished_at=time.time())
+                continue
+            _update_job(job_id, status=STATUS_QUEUED)
+            self._schedule(job_id, file_path, user_id, session_id, file_hash)
+        if rows:
+            logger.info("已恢复 %d 个未完成的入库任务", len(rows))
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                # 未完成的任务状态已持久化，下次启动时由 recover 重新调度
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+init_ingestion_jobs()
+
+ingestion_queue = IngestionQueue()
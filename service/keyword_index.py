@@ -0,0 +1,285 @@
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+current_path = os.path.abspath(__file__)
+parent_path = os.path.dirname(os.path.dirname(current_path))
+
+# 🛠 配置部分
+KEYWORD_INDEX_PATH = os.getenv("KEYWORD_INDEX_PATH", f'{parent_path}/chroma_db/keyword_index.sqlite3')  # 倒排索引文件
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 字母数字串（合同编号、条款号等）整体作为一个词，中文按二元组切分
+_TOKEN_PATTERN = re.compile(r'[a-z0-9](?:[a-z0-9._\-/]*[a-z0-9])?|[㐀-鿿豈-﫿]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """中文分词：中文连续片段切成字二元组（单字片段保留单字），字母数字串保持完整"""
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        piece = match.group()
+        if piece[0].isascii():
+            tokens.append(piece)
+        elif len(piece) == 1:
+            tokens.append(piece)
+        else:
+            tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+    return tokens
+
+
+class KeywordIndex:
+    """
+    基于 SQLite 的本地倒排索引，按 user_id / session_id / file_path 限定检索范围，使用 BM25 打分。
+
+    关键词检索不需要调用向量模型。posting 表以 (user_id, term, session_id, chunk_id) 为主键并冗余块长度，
+    按租户（及会话）查词是一次索引范围扫描，不会扫到其他租户的 posting；
+    每个文件的块数与总长度在写入时增量维护，查询时按范围汇总几行即可得到 BM25 所需的统计量。
+    """
+
+    def __init__(self, db_path: str = KEYWORD_INDEX_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._conn()
+        with conn:
+            conn.executescript('''
+            CREATE TABLE IF NOT EXISTS keyword_chunks (
+                chunk_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_keyword_chunks_scope ON keyword_chunks (user_id, session_id, file_path);
+            CREATE TABLE IF NOT EXISTS keyword_stats (
+                user_id TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                doc_count INTEGER NOT NULL,
+                total_length INTEGER NOT NULL,
+                PRIMARY KEY (user_id, session_id, file_path)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS keyword_meta (
+                name TEXT PRIMARY KEY,
+                value TEXT
+            );
+            ''')
+            self._migrate_postings(conn)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL;')
+            conn.execute('PRAGMA synchronous=NORMAL;')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _migrate_postings(conn):
+        """
+        建立按租户组织的 posting 表与统计表。旧版本的 posting 表以 (term, chunk_id) 为主键、没有租户列，
+        按 keyword_chunks 补上租户和长度后按新主键顺序整体复制；迁移与完成标记在同一事务中提交。
+        """
+        if conn.execute("SELECT 1 FROM keyword_meta WHERE name = 'postings_scoped'").fetchone():
+            return
+        conn.execute('BEGIN IMMEDIATE;')
+        # 多个进程同时启动时，拿到写锁后再确认一次是否已由其他进程完成
+        if conn.execute("SELECT 1 FROM keyword_meta WHERE name = 'postings_scoped'").fetchone():
+            return
+        legacy = bool(conn.execute('PRAGMA table_info(keyword_postings);').fetchall())
+        if legacy:
+            conn.execute('DROP INDEX IF EXISTS idx_keyword_postings_chunk;')
+            conn.execute('ALTER TABLE keyword_postings RENAME TO keyword_postings_legacy;')
+        conn.execute('''
+        CREATE TABLE keyword_postings (
+            user_id TEXT NOT NULL,
+            term TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            chunk_id TEXT NOT NULL,
+            tf INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            PRIMARY KEY (user_id, term, session_id, chunk_id)
+        ) WITHOUT ROWID;
+        ''')
+        if legacy:
+            copied = conn.execute('''
+            INSERT INTO keyword_postings (user_id, term, session_id, chunk_id, tf, length)
+            SELECT c.user_id, p.term, c.session_id, p.chunk_id, p.tf, c.length
+            FROM keyword_postings_legacy p JOIN keyword_chunks c ON c.chunk_id = p.chunk_id
+            ORDER BY c.user_id, p.term, c.session_id, p.chunk_id
+            ''').rowcount
+            conn.execute('DROP TABLE keyword_postings_legacy;')
+            logger.info("关键词索引 posting 已按租户重建：%d 条", copied)
+        conn.execute('CREATE INDEX idx_keyword_postings_chunk ON keyword_postings (chunk_id);')
+        conn.execute('DELETE FROM keyword_stats;')
+        conn.execute('''
+        INSERT INTO keyword_stats (user_id, session_id, file_path, doc_count, total_length)
+        SELECT user_id, session_id, file_path, COUNT(*), SUM(length) FROM keyword_chunks
+        GROUP BY user_id, session_id, file_path
+        ''')
+        conn.execute("INSERT INTO keyword_meta (name, value) VALUES ('postings_scoped', '1');")
+
+    @staticmethod
+    def _update_stats(conn, deltas: Dict[tuple, List[int]]):
+        """按 (user_id, session_id, file_path) 累加块数与总长度的增量，删除后为 0 的行一并清理"""
+        conn.executemany('''
+        INSERT INTO keyword_stats (user_id, session_id, file_path, doc_count, total_length) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, session_id, file_path) DO UPDATE SET
+            doc_count = doc_count + excluded.doc_count, total_length = total_length + excluded.total_length
+        ''', [(*scope, doc_count, total_length) for scope, (doc_count, total_length) in deltas.items()])
+        conn.execute('DELETE FROM keyword_stats WHERE doc_count <= 0;')
+
+    def add(self, ids: List[str], documents: List[str], metadatas: List[dict]):
+        """增量写入文档块（已存在的块会被覆盖）"""
+        if not ids:
+            return
+        chunks, postings, deltas = [], [], {}
+        for chunk_id, document, metadata in zip(ids, documents, metadatas):
+            scope = (metadata["user_id"], metadata["session_id"], metadata["file_path"])
+            tokens = tokenize(document)
+            chunks.append((chunk_id, *scope, len(tokens), document, json.dumps(metadata, ensure_ascii=False)))
+            postings.extend((scope[0], term, scope[1], chunk_id, tf, len(tokens))
+                            for term, tf in Counter(tokens).items())
+            delta = deltas.setdefault(scope, [0, 0])
+            delta[0] += 1
+            delta[1] += len(tokens)
+
+        conn = self._conn()
+        with conn:
+            self._delete(conn, ids)
+            conn.executemany('''
+            INSERT INTO keyword_chunks (chunk_id, user_id, session_id, file_path, length, content, metadata)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', chunks)
+            conn.executemany('''
+            INSERT INTO keyword_postings (user_id, term, session_id, chunk_id, tf, length) VALUES (?, ?, ?, ?, ?, ?)
+            ''', postings)
+            self._update_stats(conn, deltas)
+
+    def update_metadata(self, ids: List[str], metadatas: List[dict]):
+        if not ids:
+            return
+        conn = self._conn()
+        with conn:
+            conn.executemany('UPDATE keyword_chunks SET metadata = ? WHERE chunk_id = ?',
+                             [(json.dumps(metadata, ensure_ascii=False), chunk_id)
+                              for chunk_id, metadata in zip(ids, metadatas)])
+
+    def delete(self, ids: List[str]):
+        if not ids:
+            return
+        conn = self._conn()
+        with conn:
+            self._delete(conn, ids)
+
+    def _delete(self, conn, ids: List[str]):
+        deltas = {}
+        for part in _chunked(ids, 500):
+            for user_id, session_id, file_path, length in conn.execute(
+                    f'SELECT user_id, session_id, file_path, length FROM keyword_chunks '
+                    f'WHERE chunk_id IN ({", ".join("?" * len(part))})', part):
+                delta = deltas.setdefault((user_id, session_id, file_path), [0, 0])
+                delta[0] -= 1
+                delta[1] -= length
+        if not deltas:
+            return
+        conn.executemany('DELETE FROM keyword_postings WHERE chunk_id = ?', [(chunk_id,) for chunk_id in ids])
+        conn.executemany('DELETE FROM keyword_chunks WHERE chunk_id = ?', [(chunk_id,) for chunk_id in ids])
+        self._update_stats(conn, deltas)
+
+    def missing_ids(self, ids: List[str]) -> List[str]:
+        """返回尚未写入索引的块 ID"""
+        conn = self._conn()
+        existing = set()
+        for part in _chunked(ids, 500):
+            existing.update(row[0] for row in conn.execute(
+                f'SELECT chunk_id FROM keyword_chunks WHERE chunk_id IN ({", ".join("?" * len(part))})', part))
+        return [chunk_id for chunk_id in ids if chunk_id not in existing]
+
+    def get_meta(self, name: str) -> Optional[str]:
+        row = self._conn().execute('SELECT value FROM keyword_meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, name: str, value: str):
+        conn = self._conn()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO keyword_meta (name, value) VALUES (?, ?)', (name, value))
+
+    def search(self, query: str, user_id: str, session_id: Optional[str] = None,
+               file_path: Optional[str] = None, k: int = 10) -> List[dict]:
+        """
+        BM25 关键词检索，返回 [{chunk_id, score, content, metadata}]，按得分降序
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        stats_sql = 'user_id = ?'
+        stats_params = [user_id]
+        if session_id:
+            stats_sql += ' AND session_id = ?'
+            stats_params.append(session_id)
+        if file_path:
+            stats_sql += ' AND file_path = ?'
+            stats_params.append(file_path)
+
+        conn = self._conn()
+        total, total_length = conn.execute(
+            f'SELECT SUM(doc_count), SUM(total_length) FROM keyword_stats WHERE {stats_sql}', stats_params
+        ).fetchone()
+        if not total:
+            return []
+        avg_length = total_length / total
+
+        # 主键前缀 (user_id, term[, session_id]) 上的范围扫描；只有限定文件时才需要按块 ID 回表过滤
+        term_placeholders = ", ".join("?" * len(terms))
+        postings_sql = 'SELECT p.term, p.chunk_id, p.tf, p.length FROM keyword_postings p'
+        params = []
+        if file_path:
+            postings_sql += ' JOIN keyword_chunks c ON c.chunk_id = p.chunk_id AND c.file_path = ?'
+            params.append(file_path)
+        postings_sql += f' WHERE p.user_id = ? AND p.term IN ({term_placeholders})'
+        params.extend([user_id, *terms])
+        if session_id:
+            postings_sql += ' AND p.session_id = ?'
+            params.append(session_id)
+        rows = conn.execute(postings_sql, params).fetchall()
+
+        document_freq = Counter(term for term, _, _, _ in rows)
+        scores: Dict[str, float] = {}
+        for term, chunk_id, tf, length in rows:
+            idf = math.log(1 + (total - document_freq[term] + 0.5) / (document_freq[term] + 0.5))
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / (avg_length or 1))
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        if not top:
+            return []
+        details = {row[0]: row[1:] for row in conn.execute(
+            f'SELECT chunk_id, content, metadata FROM keyword_chunks WHERE chunk_id IN ({", ".join("?" * len(top))})',
+            [chunk_id for chunk_id, _ in top],
+        )}
+        return [{"chunk_id": chunk_id, "score": score, "content": details[chunk_id][0],
+                 "metadata": json.loads(details[chunk_id][1])}
+                for chunk_id, score in top]
+
+
+def _chunked(items: List[str], size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+keyword_index = KeywordIndex()
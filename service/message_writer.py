@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from service.sql import MESSAGE_STATUS_DONE, insert_conversation_messages
+
+# 配置日志
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 🛠 配置部分
+MESSAGE_QUEUE_SIZE = int(os.getenv("MESSAGE_QUEUE_SIZE", 10000))  # 待写入消息的队列上限，满时写入方等待
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", 256))  # 单个事务最多写入的消息数
+MESSAGE_FLUSH_MS = float(os.getenv("MESSAGE_FLUSH_MS", 50))  # 首条消息入队后最多等待多久提交
+
+_STOP = object()
+
+
+class MessageWriter:
+    """
+    对话消息的后写（write-behind）写入器。
+
+    调用方把消息放入有界队列后立即返回，后台线程攒够 batch_size 条或等待 flush_ms 后在一个事务中提交，
+    多条消息共用一次 fsync。队列满时写入方阻塞等待（异步调用方在线程池中等待），形成背压。
+    """
+
+    def __init__(self, max_queue_size: int = MESSAGE_QUEUE_SIZE, batch_size: int = MESSAGE_BATCH_SIZE,
+                 flush_ms: float = MESSAGE_FLUSH_MS, name: str = "message-writer"):
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue_size)
+        self._name = name
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name=self._name, daemon=True)
+                self._thread.start()
+
+    @staticmethod
+    def _row(user_id: str, session_id: str, parent_id: int, message_id: str, qa_id, qa_type: str,
+             message_content: str, status: str = MESSAGE_STATUS_DONE) -> tuple:
+        return user_id, session_id, parent_id, message_id, qa_id, qa_type, message_content, status
+
+    def submit(self, **fields):
+        """同步入队，参数与 insert_into_conversation_messages 相同；队列满时阻塞"""
+        self._ensure_worker()
+        self._queue.put(self._row(**fields))
+
+    async def asubmit(self, **fields):
+        """异步入队：队列未满时直接放入，不切换线程；队列满时在线程池中等待空位"""
+        self._ensure_worker()
+        row = self._row(**fields)
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            logger.debug("消息写入队列已满，等待后台写入")
+            await asyncio.to_thread(self._queue.put, row)
+
+    def _collect(self) -> List:
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_ms / 1000
+        while len(items) < self.batch_size and items[-1] is not _STOP:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return items
+
+    def _write(self, rows: List[tuple]):
+        try:
+            insert_conversation_messages(rows)
+            self.written += len(rows)
+        except sqlite3.Error as e:
+            # 批量事务失败时逐条重试，只丢弃本身有问题的消息
+            logger.error("批量写入 %d 条消息失败，改为逐条写入：%s", len(rows), e)
+            for row in rows:
+                try:
+                    insert_conversation_messages([row])
+                    self.written += 1
+                except sqlite3.Error as row_error:
+                    self.failed += 1
+                    logger.error("消息写入失败，已丢弃 message_id=%s：%s", row[3], row_error)
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+            rows = [item for item in items if item is not _STOP]
+            if rows:
+                start = time.perf_counter()
+                self._write(rows)
+                logger.debug("批量写入 %d 条消息，耗时 %.1fms", len(rows), (time.perf_counter() - start) * 1000)
+            for _ in items:
+                self._queue.task_done()
+            if len(rows) < len(items):
+                return
+
+    def flush(self):
+        """等待已入队的消息全部写入"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def close(self):
+        """写完队列中剩余的消息后停止后台线程，应用退出时调用"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+            logger.info("消息写入器已停止，共写入 %d 条，失败 %d 条", self.written, self.failed)
+
+
+message_writer = MessageWriter()
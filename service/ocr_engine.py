@@ -0,0 +1,149 @@
+import io
+import logging
+import os
+import queue
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Union
+
+import numpy as np
+from PIL import Image, ImageSequence
+from rapidocr_onnxruntime import RapidOCR
+
+# 配置日志
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 🛠 配置部分
+OCR_POOL_SIZE = int(os.getenv("OCR_POOL_SIZE", 1))  # 每个进程内的 OCR 引擎实例数
+OCR_REC_BATCH_NUM = int(os.getenv("OCR_REC_BATCH_NUM", 16))  # 识别阶段每批处理的文本行数
+
+# 支持 OCR 的图片扩展名
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+ImageInput = Union[str, bytes, np.ndarray]
+
+
+@dataclass
+class OcrResult:
+    """单张图片的 OCR 结果"""
+    text: str
+    elapsed_ms: float
+
+
+class OcrStats:
+    """OCR 单图耗时统计，用于评估引擎池大小"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms: float):
+        with self._lock:
+            self.count += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "images": self.count,
+                "avg_ms": round(self.total_ms / self.count, 1) if self.count else 0.0,
+                "max_ms": round(self.max_ms, 1),
+                "pool_size": OCR_POOL_SIZE,
+            }
+
+
+class OcrEnginePool:
+    """
+    进程内共享的 RapidOCR 引擎池。
+
+    模型在首次使用时才加载，之后所有调用复用同一批实例，避免每次调用都重新加载 ONNX 检测/识别模型。
+    """
+
+    def __init__(self, size: int = OCR_POOL_SIZE):
+        self.size = max(1, size)
+        self._engines: "queue.Queue[RapidOCR]" = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.stats = OcrStats()
+
+    def _acquire(self) -> RapidOCR:
+        with self._lock:
+            if self._engines.empty() and self._created < self.size:
+                self._created += 1
+                logger.info("加载 OCR 引擎（%d/%d）", self._created, self.size)
+                return RapidOCR(rec_batch_num=OCR_REC_BATCH_NUM)
+        return self._engines.get()
+
+    def ocr(self, image: ImageInput) -> OcrResult:
+        """识别单张图片"""
+        engine = self._acquire()
+        start = time.perf_counter()
+        try:
+            result, _ = engine(image)
+        finally:
+            self._engines.put(engine)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.stats.record(elapsed_ms)
+        text = "\n".join(line[1] for line in result) if result else ""
+        return OcrResult(text=text, elapsed_ms=elapsed_ms)
+
+    def ocr_batch(self, images: List[ImageInput]) -> List[OcrResult]:
+        """
+        批量识别图片，按输入顺序返回结果。
+
+        图片在引擎池内并发处理（onnxruntime 推理期间释放 GIL），单张图片内的文本行按 OCR_REC_BATCH_NUM 成批识别。
+        """
+        if not images:
+            return []
+        if self.size == 1 or len(images) == 1:
+            results = [self.ocr(image) for image in images]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.size, len(images))) as executor:
+                results = list(executor.map(self.ocr, images))
+        # 解析在子进程中执行，统计信息随日志输出，用于评估引擎池大小
+        logger.info("批量OCR完成：%d 张图片, 单图耗时 %s, 累计统计 %s",
+                    len(results), [round(r.elapsed_ms, 1) for r in results], self.stats.snapshot())
+        return results
+
+
+_pool: Optional[OcrEnginePool] = None
+_pool_lock = threading.Lock()
+
+
+def get_ocr_pool() -> OcrEnginePool:
+    """获取进程级共享的 OCR 引擎池（惰性创建）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OcrEnginePool()
+        return _pool
+
+
+def pil_to_bgr(frame: Image.Image) -> np.ndarray:
+    # RapidOCR 与 OpenCV 一致使用 BGR 通道顺序
+    return np.ascontiguousarray(np.array(frame.convert("RGB"))[:, :, ::-1])
+
+
+def load_image_frames(source: Union[str, bytes]) -> List[np.ndarray]:
+    """读取图片的所有帧（多帧 TIFF 会拆成多张），source 可以是文件路径或图片字节"""
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+        return [pil_to_bgr(frame) for frame in ImageSequence.Iterator(image)]
+
+
+def load_zip_images(file_path: str) -> List[tuple]:
+    """读取压缩包内的全部图片，返回 [(成员名, 帧序号, 图片)]"""
+    images = []
+    with zipfile.ZipFile(file_path) as archive:
+        for name in sorted(archive.namelist()):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            for frame_no, frame in enumerate(load_image_frames(archive.read(name))):
+                images.append((name, frame_no, frame))
+    return images
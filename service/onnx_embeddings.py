@@ -0,0 +1,166 @@
+import argparse
+import logging
+import os
+import random
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# 配置日志
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 🛠 配置部分
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")  # 向量模型后端：torch / onnx / onnx-int8
+ONNX_MAX_LENGTH = int(os.getenv("ONNX_MAX_LENGTH", 512))  # 与 bge-large-zh 的 max_seq_length 一致
+ONNX_BATCH_SIZE = int(os.getenv("ONNX_BATCH_SIZE", 32))
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", 0))  # 0 表示由 onnxruntime 自动决定
+
+
+def export_onnx(model_dir: str, onnx_path: str):
+    """把 HuggingFace 格式的 bge 模型导出为 ONNX（动态 batch 与序列长度）"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    logger.info("导出 ONNX 模型：%s -> %s", model_dir, onnx_path)
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = AutoModel.from_pretrained(model_dir).eval()
+    sample = tokenizer(["导出样例"], return_tensors="pt")
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            onnx_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+
+
+def quantize_onnx(onnx_path: str, int8_path: str):
+    """动态 int8 量化（仅量化权重，激活在推理时动态量化）"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    logger.info("int8 动态量化：%s -> %s", onnx_path, int8_path)
+    quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    基于 ONNX Runtime 的 bge 向量模型。
+
+    首次使用时从 model_dir 导出 ONNX 文件（可选再做 int8 动态量化），之后直接加载。
+    与 HuggingFaceEmbeddings(normalize_embeddings=True) 保持相同的向量约定：取 [CLS] 向量并做 L2 归一化，
+    已有的 Chroma 集合无需重建。
+    """
+
+    def __init__(self, model_dir: str, quantize: bool = False, max_length: int = ONNX_MAX_LENGTH,
+                 batch_size: int = ONNX_BATCH_SIZE, intra_op_threads: int = ONNX_INTRA_OP_THREADS):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        onnx_path = os.path.join(model_dir, "onnx", "model.onnx")
+        model_path = os.path.join(model_dir, "onnx", "model.int8.onnx") if quantize else onnx_path
+        if not os.path.exists(onnx_path):
+            os.makedirs(os.path.dirname(onnx_path), exist_ok=True)
+            export_onnx(model_dir, onnx_path)
+        if quantize and not os.path.exists(model_path):
+            quantize_onnx(onnx_path, model_path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length
+        self.batch_size = batch_size
+        logger.info("ONNX 向量模型已加载：%s", model_path)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        tokens = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+        inputs = {name: tokens[name].astype(np.int64) for name in self.input_names}
+        cls = self.session.run(None, inputs)[0][:, 0]
+        return cls / np.linalg.norm(cls, axis=1, keepdims=True)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = [self._encode(texts[start:start + self.batch_size])
+                   for start in range(0, len(texts), self.batch_size)]
+        return np.concatenate(vectors).tolist() if vectors else []
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
+
+
+def create_base_embeddings(model_dir: str, backend: str = EMBEDDING_BACKEND) -> Embeddings:
+    """按配置创建底层向量模型"""
+    if backend == "torch":
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        return HuggingFaceEmbeddings(
+            model_name=model_dir,
+            model_kwargs={'device': 'cpu'},
+            encode_kwargs={'normalize_embeddings': True}
+        )
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEmbeddings(model_dir, quantize=backend == "onnx-int8")
+    raise ValueError(f"不支持的向量模型后端：{backend}")
+
+
+def recall_check(reference: Embeddings, candidate: Embeddings, corpus: List[str],
+                 queries: Optional[List[str]] = None, k: int = 10) -> dict:
+    """
+    对比候选后端与 fp32 参考模型的检索一致性。
+
+    recall_at_k 为候选后端 top-k 结果与参考模型 top-k 结果的平均重合率，
+    mean_cosine 为同一文本在两个后端下向量的平均余弦相似度。
+    """
+    queries = queries or random.Random(0).sample(corpus, min(len(corpus), 50))
+    ref_docs = np.asarray(reference.embed_documents(corpus))
+    cand_docs = np.asarray(candidate.embed_documents(corpus))
+    ref_queries = np.asarray([reference.embed_query(query) for query in queries])
+    cand_queries = np.asarray([candidate.embed_query(query) for query in queries])
+
+    k = min(k, len(corpus))
+    ref_top = np.argsort(-ref_queries @ ref_docs.T, axis=1)[:, :k]
+    cand_top = np.argsort(-cand_queries @ cand_docs.T, axis=1)[:, :k]
+    overlaps = [len(set(ref_row) & set(cand_row)) / k for ref_row, cand_row in zip(ref_top, cand_top)]
+
+    return {
+        "queries": len(queries),
+        "corpus": len(corpus),
+        "k": k,
+        "recall_at_k": round(float(np.mean(overlaps)), 4),
+        "mean_cosine": round(float(np.mean(np.sum(ref_docs * cand_docs, axis=1))), 6),
+    }
+
+
+if __name__ == "__main__":
+    # 用法：python -m service.onnx_embeddings --corpus passages.txt --backend onnx-int8
+    parser = argparse.ArgumentParser(description="对比 ONNX 向量后端与 fp32 模型的召回一致性")
+    parser.add_argument("--model-dir", default=os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), "models", "bge-large-zh-v1.5"))
+    parser.add_argument("--corpus", required=True, help="语料文件，每行一段文本")
+    parser.add_argument("--queries", help="查询文件，每行一条；缺省时从语料中抽样")
+    parser.add_argument("--backend", default="onnx-int8", choices=["onnx", "onnx-int8"])
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with open(args.corpus, encoding="utf-8") as fp:
+        corpus_lines = [line.strip() for line in fp if line.strip()]
+    query_lines = None
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as fp:
+            query_lines = [line.strip() for line in fp if line.strip()]
+
+    result = recall_check(create_base_embeddings(args.model_dir, "torch"),
+                          create_base_embeddings(args.model_dir, args.backend),
+                          corpus_lines, query_lines, args.k)
+    print(result)
@@ -0,0 +1,224 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from core.base.exception import ParseWorkerError, ParseTimeoutError, ParseWorkerCrashedError
+
+# 配置日志
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 🛠 配置部分
+PARSE_POOL_ENABLED = os.getenv("PARSE_POOL_ENABLED", "1") == "1"  # 关闭后回退为当前线程内解析
+
+# 扩展名 -> 格式分组，每个分组使用独立的进程池
+FORMAT_GROUPS = {
+    '.txt': 'text',
+    '.md': 'text',
+    '.doc': 'office',
+    '.docx': 'office',
+    '.pdf': 'pdf',
+    '.jpg': 'image',
+    '.jpeg': 'image',
+    '.png': 'image',
+    '.bmp': 'image',
+    '.tif': 'image',
+    '.tiff': 'image',
+    '.zip': 'image',
+}
+
+# 各分组的进程数
+POOL_SIZES = {
+    'text': int(os.getenv("PARSE_POOL_TEXT_SIZE", 1)),
+    'office': int(os.getenv("PARSE_POOL_OFFICE_SIZE", 2)),
+    'pdf': int(os.getenv("PARSE_POOL_PDF_SIZE", 2)),
+    'image': int(os.getenv("PARSE_POOL_IMAGE_SIZE", 1)),
+}
+
+# 各分组的单任务超时（秒），超时后强制终止对应子进程
+TASK_TIMEOUTS = {
+    'text': float(os.getenv("PARSE_TIMEOUT_TEXT", 60)),
+    'office': float(os.getenv("PARSE_TIMEOUT_OFFICE", 300)),
+    'pdf': float(os.getenv("PARSE_TIMEOUT_PDF", 600)),
+    'image': float(os.getenv("PARSE_TIMEOUT_IMAGE", 120)),
+}
+
+def split_file(file_path: str) -> list:
+    """默认解析任务：在子进程中加载并切分单个文件"""
+    # 延迟导入，避免父进程与子进程模块循环依赖
+    from service.document_processor import split_document_inline
+
+    return split_document_inline(file_path)
+
+
+def _worker_main(conn):
+    """子进程入口：循环接收 (函数, 参数) 任务，执行后把结果发回父进程"""
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if task is None:
+            break
+        func, args = task
+        try:
+            conn.send(("ok", func(*args)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+class _Worker:
+    """单个常驻解析子进程"""
+
+    def __init__(self, ctx, name: str):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), name=name, daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def run(self, func: Callable, args: tuple, label: str, timeout: float) -> Any:
+        try:
+            self.conn.send((func, args))
+            # 子进程崩溃时管道会变为可读（EOF），poll 会立即返回
+            if not self.conn.poll(timeout):
+                raise ParseTimeoutError(f"解析超时（{timeout:.0f}s）：{label}")
+            status, payload = self.conn.recv()
+        except (EOFError, OSError):
+            self.process.join(1)
+            raise ParseWorkerCrashedError(f"解析进程异常退出（exitcode={self.process.exitcode}）：{label}")
+        if status == "error":
+            raise ParseWorkerError(f"解析失败：{label}, {payload}")
+        return payload
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class FormatWorkerPool:
+    """
+    某一格式分组的解析进程池。
+
+    子进程按需启动并常驻复用；任务超时或子进程崩溃时只终止该子进程，
+    下次取用时重新拉起，不影响 API 主进程。
+    """
+
+    def __init__(self, name: str, size: int, timeout: float):
+        self.name = name
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._ctx = multiprocessing.get_context("spawn")
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle: "queue.LifoQueue[_Worker]" = queue.LifoQueue()
+        self._spawned = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> _Worker:
+        self._slots.acquire()
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    self._spawned += 1
+                    name = f"parse-{self.name}-{self._spawned}"
+                try:
+                    return _Worker(self._ctx, name)
+                except Exception:
+                    self._slots.release()
+                    raise
+            if worker.is_alive():
+                return worker
+            worker.kill()
+
+    def _release(self, worker: _Worker, healthy: bool):
+        if healthy:
+            self._idle.put(worker)
+        else:
+            worker.kill()
+        self._slots.release()
+
+    def run(self, file_path: str, timeout: Optional[float] = None) -> list:
+        """在子进程中加载并切分单个文件"""
+        return self.call(split_file, file_path, timeout=timeout, label=file_path)
+
+    def call(self, func: Callable, *args, timeout: Optional[float] = None, label: Optional[str] = None) -> Any:
+        """
+        在子进程中执行 func(*args)，func 须为模块级函数（以 spawn 方式传给子进程）。
+        超时或崩溃时终止该子进程并抛出 ParseWorkerError 的子类。
+        """
+        label = label or f"{func.__name__}{args}"
+        worker = self._acquire()
+        healthy = False
+        start = time.perf_counter()
+        try:
+            result = worker.run(func, args, label, timeout or self.timeout)
+            healthy = True
+            return result
+        except (ParseTimeoutError, ParseWorkerCrashedError):
+            logger.error("解析进程 %s 已终止并将在下次任务时重启", worker.process.name)
+            raise
+        except ParseWorkerError:
+            # 加载器正常抛出的异常，子进程本身仍可复用
+            healthy = True
+            raise
+        finally:
+            self._release(worker, healthy)
+            logger.info("[%s] 解析 %s 耗时 %.1fms", self.name, label, (time.perf_counter() - start) * 1000)
+
+    def shutdown(self):
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+
+class ParseEngine:
+    """按文件格式把解析任务分发到对应进程池"""
+
+    def __init__(self):
+        self._pools: Dict[str, FormatWorkerPool] = {}
+        self._lock = threading.Lock()
+
+    def get_pool(self, group: str) -> FormatWorkerPool:
+        with self._lock:
+            if group not in self._pools:
+                self._pools[group] = FormatWorkerPool(group, POOL_SIZES[group], TASK_TIMEOUTS[group])
+            return self._pools[group]
+
+    def parse(self, file_path: str) -> list:
+        """在子进程中加载并切分单个文件"""
+        ext = os.path.splitext(file_path)[-1].lower()
+        group = FORMAT_GROUPS.get(ext)
+        if group is None:
+            logger.error("不支持的文件类型：%s", ext)
+            return []
+        return self.get_pool(group).run(file_path)
+
+    def shutdown(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.shutdown()
+            self._pools.clear()
+
+
+parse_engine = ParseEngine()
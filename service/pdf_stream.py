@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from pdf2image import convert_from_path
+from pypdf import PdfReader
+
+from service.ocr_engine import get_ocr_pool, pil_to_bgr
+from service.parse_pool import POOL_SIZES, parse_engine
+
+# 配置日志
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 🛠 配置部分
+PDF_STREAMING_ENABLED = os.getenv("PDF_STREAMING_ENABLED", "1") == "1"  # 是否启用 PDF 流式解析
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", POOL_SIZES['pdf']))  # 并行派发页区间的线程数，进程数由 PARSE_POOL_PDF_SIZE 决定
+PDF_RANGE_TIMEOUT = float(os.getenv("PDF_RANGE_TIMEOUT", 120))  # 单个页区间（含 OCR）的抽取超时（秒），超时后终止对应子进程
+PDF_PAGE_RANGE_SIZE = int(os.getenv("PDF_PAGE_RANGE_SIZE", 4))  # 每个抽取任务包含的页数
+PDF_WINDOW_RANGES = int(os.getenv("PDF_WINDOW_RANGES", 4))  # 同时在途的页区间数，决定内存窗口
+PDF_OCR_ENABLED = os.getenv("PDF_OCR_ENABLED", "1") == "1"  # 是否对无文本层的扫描页做 OCR
+PDF_OCR_MIN_CHARS = int(os.getenv("PDF_OCR_MIN_CHARS", 10))  # 抽取文本少于该字符数的页视为扫描页
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", 200))  # 扫描页栅格化分辨率
+
+# 页区间由派发线程提交到 parse_engine 的 pdf 进程池执行，沿用其单任务超时和崩溃后重启子进程的隔离机制
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, thread_name_prefix="pdf-extract")
+        return _executor
+
+
+def shutdown_pdf_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def needs_ocr(text: str) -> bool:
+    """页面没有或几乎没有文本层时需要 OCR"""
+    return PDF_OCR_ENABLED and len(text.strip()) < PDF_OCR_MIN_CHARS
+
+
+def ocr_pdf_pages(file_path: str, page_numbers: List[int]) -> dict:
+    """
+    只栅格化指定页（从 0 开始计数）并通过共享 OCR 引擎池批量识别，返回 {页码: 文本}
+    """
+    if not page_numbers:
+        return {}
+    try:
+        images = [pil_to_bgr(image)
+                  for page_no in page_numbers
+                  for image in convert_from_path(file_path, dpi=PDF_OCR_DPI,
+                                                 first_page=page_no + 1, last_page=page_no + 1)]
+        results = get_ocr_pool().ocr_batch(images)
+        logger.info("PDF扫描页OCR完成：%s, 页码 %s", file_path, page_numbers)
+        return {page_no: result.text for page_no, result in zip(page_numbers, results)}
+    except Exception as e:
+        # OCR 失败时保留原有抽取结果，不影响文本页入库
+        logger.exception("PDF扫描页OCR时出错：%s", e)
+        return {}
+
+
+def _count_pages(file_path: str) -> int:
+    """在子进程中读取页数，API 主进程不直接解析上传的 PDF"""
+    return len(PdfReader(file_path).pages)
+
+
+def _extract_page_range(file_path: str, start: int, end: int) -> List[Tuple[int, str, bool]]:
+    """在子进程中抽取 [start, end) 页的文本，扫描页在本进程内走 OCR，返回 [(页码, 文本, 是否OCR)]"""
+    reader = PdfReader(file_path)
+    pages = [(page_no, reader.pages[page_no].extract_text() or "") for page_no in range(start, end)]
+    ocr_texts = ocr_pdf_pages(file_path, [page_no for page_no, text in pages if needs_ocr(text)])
+    return [(page_no, ocr_texts.get(page_no, text), page_no in ocr_texts) for page_no, text in pages]
+
+
+def iter_pdf_pages(file_path: str) -> Iterator[Document]:
+    """
+    按页区间并行抽取 PDF 文本，并按页码顺序逐页产出 Document。
+    扫描页在各自的抽取进程中并行 OCR，metadata["ocr"] 标记文本是否来自 OCR。
+
+    同时在途的页区间不超过 PDF_WINDOW_RANGES 个，内存占用只与窗口大小有关，与文档总页数无关。
+    页数读取和页区间抽取都在 pdf 解析进程池中执行，单个区间超时或子进程崩溃时抛出 ParseWorkerError。
+    """
+    pool = parse_engine.get_pool('pdf')
+    total_pages = pool.call(_count_pages, file_path, timeout=PDF_RANGE_TIMEOUT, label=f"{file_path} 页数")
+    logger.info("流式解析PDF文件：%s, 共 %d 页", file_path, total_pages)
+
+    executor = _get_executor()
+    ranges = ((start, min(start + PDF_PAGE_RANGE_SIZE, total_pages))
+              for start in range(0, total_pages, PDF_PAGE_RANGE_SIZE))
+    pending = deque()
+
+    try:
+        for start, end in ranges:
+            pending.append(executor.submit(pool.call, _extract_page_range, file_path, start, end,
+                                           timeout=PDF_RANGE_TIMEOUT, label=f"{file_path} 第 {start + 1}-{end} 页"))
+            if len(pending) < PDF_WINDOW_RANGES:
+                continue
+            yield from _to_documents(pending.popleft().result(), file_path, total_pages)
+        while pending:
+            yield from _to_documents(pending.popleft().result(), file_path, total_pages)
+    finally:
+        # 消费方提前退出时取消尚未开始的页区间
+        for future in pending:
+            future.cancel()
+
+
+def _to_documents(pages: List[Tuple[int, str, bool]], file_path: str, total_pages: int) -> Iterator[Document]:
+    for page_no, text, is_ocr in pages:
+        yield Document(page_content=text,
+                       metadata={"source": file_path, "page": page_no, "total_pages": total_pages, "ocr": is_ocr})
+
+
+def iter_pdf_split_documents(file_path: str, chunk_size=200, chunk_overlap=20) -> Iterator[Document]:
+    """
+    流式拆分 PDF：每页文本就绪后立即切分，并惰性产出文档块供向量化阶段消费
+    """
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    for page_doc in iter_pdf_pages(file_path):
+        yield from text_splitter.split_documents([page_doc])
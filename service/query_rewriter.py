@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence
+
+from langchain_core.messages import BaseMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from core.stage_timer import get_stage_timings, record_stage, stage
+
+# 配置日志
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 🛠 配置部分
+REWRITE_MAX_TOKENS = int(os.getenv("REWRITE_MAX_TOKENS", 128))  # 问题改写的最大生成 token 数
+REWRITE_CACHE_SIZE = int(os.getenv("REWRITE_CACHE_SIZE", 1024))  # 改写结果缓存条数
+REWRITE_MIN_CHARS = int(os.getenv("REWRITE_MIN_CHARS", 6))  # 短于该长度的问题视为省略句，需要改写
+
+# 指代、省略、承接类表达：出现时问题通常依赖历史上下文。
+# 按词匹配指代，不匹配单字“该/其/此/这/那”，以免“应该、其他、尤其、因此、此外、那么”等普通词误判
+_REFERENCE_NOUNS = (r"(文件|文档|文章|资料|合同|协议|条款|公司|项目|方案|方法|问题|产品|系统|模型|内容|"
+                    r"章节|部分|报告|政策|规定|数据|表格|图片|段落|人)")
+_REFERENCE_PATTERN = re.compile(
+    r"(?<!其)[它他她]|[这那](个|些|种|样|份|篇|段|条|项|款|部|本|里|边|次|位|家|一)"
+    r"|[该此]" + _REFERENCE_NOUNS + r"|其中|其余"
+    r"|上述|上面|前面|刚才|之前|以上|继续|还有|另外|然后呢|呢[？?]?$"
+    r"|\b(it|its|they|them|their|this|that|these|those|above|previous|former|latter)\b",
+    re.IGNORECASE,
+)
+_THINK_PATTERN = re.compile(r"<think>.*?(</think>|$)", re.DOTALL)
+
+
+def needs_rewrite(question: str) -> bool:
+    """
+    本地启发式判断问题是否依赖历史上下文。
+
+    含指代/承接词或过短（如“为什么？”“还有呢”）的问题需要改写，其余视为可独立理解的问题直接检索。
+    """
+    text = question.strip()
+    if len(text) < REWRITE_MIN_CHARS:
+        return True
+    return bool(_REFERENCE_PATTERN.search(text))
+
+
+def _history_hash(history: Sequence[BaseMessage]) -> str:
+    digest = hashlib.sha1()
+    for message in history:
+        digest.update(message.type.encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(str(message.content).encode("utf-8"))
+        digest.update(b"\x01")
+    return digest.hexdigest()
+
+
+def _clean_rewrite(text: str) -> str:
+    """去掉推理模型输出的 <think> 段落；被长度上限截断在推理段内时结果为空"""
+    return _THINK_PATTERN.sub("", text).strip()
+
+
+class RewriteCache:
+    """按 (session, 历史哈希, 输入) 缓存改写结果的 LRU"""
+
+    def __init__(self, max_size: int = REWRITE_CACHE_SIZE):
+        self.max_size = max_size
+        self._items: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[str]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: tuple, value: str):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+rewrite_cache = RewriteCache()
+
+
+def create_query_contextualizer(llm, prompt, cache: RewriteCache = rewrite_cache) -> Runnable:
+    """
+    生成检索用查询：{"input", "chat_history"} -> str。
+
+    无历史或问题可独立理解时直接使用原始输入，不调用模型；
+    否则以限制长度的模型调用改写问题，结果按 (session, 历史哈希, 输入) 缓存。
+    """
+    rewrite_chain = prompt | llm.bind(num_predict=REWRITE_MAX_TOKENS) | StrOutputParser()
+
+    def lookup(inputs: Dict[str, Any], config: RunnableConfig):
+        """返回 (无需调用模型即可确定的查询, 缓存键)，查询为 None 时需要改写"""
+        question = inputs["input"]
+        history = inputs.get("chat_history") or []
+        timings = get_stage_timings(config)
+        if not history or not needs_rewrite(question):
+            record_stage(timings, "rewrite_ms", 0)
+            logger.info("跳过问题改写，直接使用原始问题检索")
+            return question, None
+
+        session_id = (config.get("configurable") or {}).get("session_id")
+        key = (session_id, _history_hash(history), question)
+        cached = cache.get(key)
+        if cached is not None:
+            record_stage(timings, "rewrite_ms", 0)
+            logger.info("命中问题改写缓存")
+        return cached, key
+
+    def store(inputs: Dict[str, Any], key: tuple, output: str) -> str:
+        rewritten = _clean_rewrite(output)
+        if not rewritten:
+            logger.info("问题改写结果为空（可能超出长度上限），使用原始问题")
+            rewritten = inputs["input"]
+        cache.put(key, rewritten)
+        return rewritten
+
+    def contextualize(inputs: Dict[str, Any], config: RunnableConfig) -> str:
+        query, key = lookup(inputs, config)
+        if query is not None:
+            return query
+        with stage(get_stage_timings(config), "rewrite_ms"):
+            output = rewrite_chain.invoke(inputs, config)
+        return store(inputs, key, output)
+
+    async def acontextualize(inputs: Dict[str, Any], config: RunnableConfig) -> str:
+        query, key = lookup(inputs, config)
+        if query is not None:
+            return query
+        with stage(get_stage_timings(config), "rewrite_ms"):
+            output = await rewrite_chain.ainvoke(inputs, config)
+        return store(inputs, key, output)
+
+    return RunnableLambda(contextualize, afunc=acontextualize).with_config(run_name="contextualize_question")
@@ -0,0 +1,106 @@
+import logging
+import os
+import threading
+import time
+from typing import List, Optional
+
+from langchain_core.documents import Document
+
+# 配置日志
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+current_path = os.path.abspath(__file__)
+parent_path = os.path.dirname(os.path.dirname(current_path))
+
+# 🛠 配置部分
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "1") == "1"  # 是否启用重排序阶段（模型不存在时自动跳过）
+RERANK_MODEL_PATH = os.getenv("RERANK_MODEL_PATH", f'{parent_path}/models/bge-reranker-base')
+RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", 20))  # 重排序前的候选召回数
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", 16))  # 每批打分的候选数
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", 300))  # 单次请求的重排序耗时预算
+RERANK_COST_SMOOTHING = 0.2  # 单对打分耗时估计的指数滑动平均系数
+
+
+class CrossEncoderReranker:
+    """
+    本地 CPU 交叉编码器重排序（如 bge-reranker），模型进程内只加载一次。
+
+    按实测的单对打分耗时（预热时测得，之后按滑动平均更新）确定每批大小，保证下一批预计在剩余预算内完成，
+    包括第一批；剩余预算不足以再打分一对时放弃重排序，按原始召回顺序截取前 k 个。
+    """
+
+    def __init__(self, model_path: str = RERANK_MODEL_PATH, batch_size: int = RERANK_BATCH_SIZE,
+                 budget_ms: float = RERANK_BUDGET_MS):
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self._model = None
+        self._lock = threading.Lock()
+        self._pair_ms: Optional[float] = None  # 单对打分耗时估计，尚未测得时为 None
+
+    @property
+    def available(self) -> bool:
+        return RERANK_ENABLED and os.path.isdir(self.model_path)
+
+    def _get_model(self):
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+
+                start = time.perf_counter()
+                self._model = CrossEncoder(self.model_path, device='cpu', max_length=512)
+                logger.info("重排序模型已加载：%s, 耗时 %.0fms", self.model_path, (time.perf_counter() - start) * 1000)
+            return self._model
+
+    def _record_cost(self, pairs: int, elapsed_ms: float):
+        pair_ms = elapsed_ms / pairs
+        if self._pair_ms is None:
+            self._pair_ms = pair_ms
+        else:
+            self._pair_ms += RERANK_COST_SMOOTHING * (pair_ms - self._pair_ms)
+
+    def warm_up(self):
+        """提前加载模型并测量单对打分耗时，避免首个请求承担加载耗时、首批大小没有依据"""
+        if not self.available:
+            return
+        model = self._get_model()
+        pairs = [("预热查询", "预热文本" * 50)] * self.batch_size
+        model.predict(pairs, batch_size=len(pairs))  # 首次推理包含初始化开销，不计入估计
+        start = time.perf_counter()
+        model.predict(pairs, batch_size=len(pairs))
+        self._record_cost(len(pairs), (time.perf_counter() - start) * 1000)
+        logger.info("重排序单对打分耗时约 %.2fms", self._pair_ms)
+
+    def _next_batch_size(self, remaining_ms: float, left: int) -> int:
+        """按剩余预算和单对耗时估计决定下一批的大小，尚无估计时先打分一对用于测量"""
+        if self._pair_ms is None:
+            return 1 if remaining_ms > 0 else 0
+        return min(self.batch_size, left, int(remaining_ms / self._pair_ms))
+
+    def rerank(self, query: str, documents: List[Document], top_k: int,
+               budget_ms: Optional[float] = None) -> List[Document]:
+        if len(documents) <= 1 or not self.available:
+            return documents[:top_k]
+
+        model = self._get_model()
+        budget = budget_ms if budget_ms is not None else self.budget_ms
+        start = time.perf_counter()
+        scores = []
+        while len(scores) < len(documents):
+            size = self._next_batch_size(budget - (time.perf_counter() - start) * 1000, len(documents) - len(scores))
+            if size <= 0:
+                logger.warning("重排序预计超出预算（%.0fms，已打分 %d/%d），回退为原始顺序",
+                               budget, len(scores), len(documents))
+                return documents[:top_k]
+            batch = documents[len(scores):len(scores) + size]
+            batch_start = time.perf_counter()
+            scores.extend(model.predict([(query, doc.page_content) for doc in batch], batch_size=len(batch)))
+            self._record_cost(len(batch), (time.perf_counter() - batch_start) * 1000)
+
+        ranked = sorted(zip(scores, range(len(documents))), key=lambda item: item[0], reverse=True)
+        logger.info("重排序 %d 个候选，耗时 %.1fms", len(documents), (time.perf_counter() - start) * 1000)
+        return [documents[index] for _, index in ranked[:top_k]]
+
+
+reranker = CrossEncoderReranker()
@@ -1,34 +1,35 @@
+import asyncio
 import logging
-from typing import Optional
+from typing import Any, Callable, Optional
 
-from langchain.chains import create_history_aware_retriever
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.chains.retrieval import create_retrieval_chain
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.prompts import MessagesPlaceholder
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+
+from core.stage_timer import get_stage_timings, stage
+from service.hybrid_retriever import HybridRetriever
+from service.keyword_index import keyword_index
+from service.query_rewriter import create_query_contextualizer
+from service.reranker import RERANK_FETCH_K, reranker
 
 # 配置日志
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-def initialize_retrieval_chain(vector_store, llm,
-                               top_k: int, file_path: Optional[str], user_id: str, session_id: str, ):
+def initialize_retrieval_chain(llm, top_k: int, vector_store_getter: Callable[[str, Optional[str]], Any]):
+    """
+    构建与请求无关的检索链，进程内只需构建一次。
+
+    检索范围在每次调用时从 config["configurable"] 中的 user_id/session_id/file_path 读取，
+    vector_store_getter(user_id, session_id) 返回租户对应的向量库，租户还没有集合时返回 None，此时不检索。
+    """
     try:
         logger.info("初始化检索链...")
-        # 构建检索过滤条件
-        filter_conditions = [{"user_id": user_id}]
-
-        if session_id:
-            filter_conditions.append({"session_id": session_id})
-        if file_path:
-            filter_conditions.append({"file_path": file_path})
-
-        # 使用 $and 组合所有条件
-        filter_condition = {"$and": filter_conditions} if len(filter_conditions) > 1 else filter_conditions[0]
-
-        # 仅检索符合条件的文档
-        retriever = vector_store.as_retriever(search_kwargs={"filter": filter_condition})
+        # 启用重排序时先多召回候选，由交叉编码器选出前 top_k 个
+        fetch_k = RERANK_FETCH_K if reranker.available else top_k
 
         # 1. 系统提示 - 检索上下文问答
         system_prompt = """
@@ -64,13 +65,59 @@ def initialize_retrieval_chain(vector_store, llm,
             ("human", "{input}")
         ])
 
-        # 创建带历史上下文的检索器
-        history_chain = create_history_aware_retriever(
-            llm=llm,
-            retriever=retriever,
-            prompt=retriever_history_prompt
-        )
+        # 生成检索用查询：无历史或问题可独立理解时跳过模型改写
+        query_chain = create_query_contextualizer(llm, retriever_history_prompt)
+
+        def scoped_retriever(config, vector_store) -> HybridRetriever:
+            scope = config.get("configurable") or {}
+            # 向量检索 + BM25 关键词检索混合召回，仅检索符合 user_id/session_id/file_path 条件的文档
+            return HybridRetriever(
+                vector_store=vector_store,
+                keyword_index=keyword_index,
+                user_id=scope["user_id"],
+                session_id=scope.get("session_id") or None,
+                file_path=scope.get("file_path") or None,
+                k=fetch_k,
+            )
+
+        def scope_key(config):
+            scope = config.get("configurable") or {}
+            return scope["user_id"], scope.get("session_id") or None
+
+        def retrieve(inputs, config):
+            query = inputs["query"]
+            timings = get_stage_timings(config)
+            vector_store = vector_store_getter(*scope_key(config))
+            if vector_store is None:
+                return []
+            retriever = scoped_retriever(config, vector_store)
+            with stage(timings, "retrieve_ms"):
+                docs = retriever.invoke(query, config)
+            # 3. 可选的重排序阶段：对候选打分后只保留前 top_k 个，减少提示词中的文档块
+            if reranker.available:
+                with stage(timings, "rerank_ms"):
+                    docs = reranker.rerank(query, docs, top_k)
+            return docs
+
+        async def aretrieve(inputs, config):
+            query = inputs["query"]
+            timings = get_stage_timings(config)
+            # 打开租户集合与重排序打分是阻塞调用，放到线程池中执行
+            vector_store = await asyncio.to_thread(vector_store_getter, *scope_key(config))
+            if vector_store is None:
+                return []
+            retriever = scoped_retriever(config, vector_store)
+            with stage(timings, "retrieve_ms"):
+                docs = await retriever.ainvoke(query, config)
+            if reranker.available:
+                with stage(timings, "rerank_ms"):
+                    docs = await asyncio.to_thread(reranker.rerank, query, docs, top_k)
+            return docs
+
+        history_chain = RunnablePassthrough.assign(query=query_chain) | RunnableLambda(retrieve, afunc=aretrieve)
         logger.info("历史上下文检索器初始化成功，top_k=%d", top_k)
+        if reranker.available:
+            logger.info("重排序阶段已启用，候选数=%d", RERANK_FETCH_K)
 
         # 创建最终的检索链
         retrieval_chain = create_retrieval_chain(retriever=history_chain, combine_docs_chain=docs_chain)
@@ -1,26 +1,189 @@
+import logging
 import os
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
 
-# 连接到 Chroma 的 SQLite 数据库
 current_path = os.path.abspath(__file__)
 parent_path1 = os.path.dirname(current_path)
 parent_path = os.path.dirname(parent_path1)
 
+# 🛠 配置部分
+# 对话数据使用独立的数据库文件，不再与 Chroma 的 chroma.sqlite3 争用同一把写锁
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", f'{parent_path}/chroma_db/conversation.sqlite3')
+LEGACY_DB_PATH = f'{parent_path}/chroma_db/chroma.sqlite3'  # 旧版本存放对话表的位置，仅用于迁移
+CONVERSATION_POOL_SIZE = int(os.getenv("CONVERSATION_POOL_SIZE", 4))  # 连接池大小
+CONVERSATION_CACHED_STATEMENTS = int(os.getenv("CONVERSATION_CACHED_STATEMENTS", 128))  # 每个连接缓存的预编译语句数
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 20))  # 历史记录默认每页轮数
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", 100))  # 历史记录每页轮数上限
 
-def init_conversation_messages():
-    conn = sqlite3.connect(f'{parent_path}/chroma_db/chroma.sqlite3')
-    cursor = conn.cursor()
+# 回答状态：正常完成 / 客户端断开后中止（只保存了已生成的部分）
+MESSAGE_STATUS_DONE = "done"
+MESSAGE_STATUS_CANCELLED = "cancelled"
+
+_MESSAGE_COLUMNS = "id, user_id, session_id, parent_id, message_id, qa_id, qa_type, message_content, status, timestamp"
+
+# SQL 文本保持不变，sqlite3 按语句文本命中连接上的预编译语句缓存
+_INSERT_MESSAGE_SQL = '''
+INSERT INTO conversation_messages
+(user_id, session_id, parent_id, message_id, qa_id, qa_type, message_content, status)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# 按问题行 id 做键集分页：问题与回答共用 message_id，一次连接查询取出一页问答，
+# (user_id, session_id, qa_type) 索引的叶子按 rowid 有序，每页只扫描 limit 行
+_SESSION_HISTORY_SQL = '''
+SELECT
+    q.id AS cursor,
+    q.qa_id,
+    q.message_content AS question,
+    q.timestamp AS question_time,
+    a.message_content AS answer,
+    a.status AS status,
+    a.timestamp AS answer_time
+FROM conversation_messages q
+LEFT JOIN conversation_messages a
+    ON a.message_id = q.message_id
+    AND a.qa_type = 'answer'
+    AND a.user_id = q.user_id
+    AND a.session_id = q.session_id
+WHERE
+    q.user_id = ?
+    AND q.session_id = ?
+    AND q.qa_type = 'question'
+    AND q.id > ?
+    AND (? IS NULL OR q.timestamp > ?)
+ORDER BY q.id ASC
+LIMIT ?;
+'''
+
+# 每个会话一行的问答序号计数器，单条语句原子递增，O(1)
+_ALLOCATE_QA_ID_SQL = '''
+INSERT INTO conversation_qa_counters (user_id, session_id, last_qa_id) VALUES (?, ?, 1)
+ON CONFLICT (user_id, session_id) DO UPDATE SET last_qa_id = last_qa_id + 1
+RETURNING last_qa_id;
+'''
+
+_LAST_QA_ID_SQL = '''
+SELECT last_qa_id FROM conversation_qa_counters WHERE user_id = ? AND session_id = ?;
+'''
+
+
+class SqliteConnectionPool:
+    """
+    线程安全的 SQLite 连接池。
+
+    连接按需创建、用完归还，最多 size 个；每个连接开启 WAL 并设置同步级别、忙等待和缓存等参数，
+    读写可以并发，写事务之间由 SQLite 串行化。
+    """
+
+    def __init__(self, db_path: str, size: int = CONVERSATION_POOL_SIZE,
+                 cached_statements: int = CONVERSATION_CACHED_STATEMENTS):
+        self.db_path = db_path
+        self.size = size
+        self.cached_statements = cached_statements
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._available = threading.Semaphore(size)
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL;')
+        conn.execute('PRAGMA synchronous=NORMAL;')  # WAL 下 NORMAL 只在检查点时同步，断电最多丢失最近的事务
+        conn.execute('PRAGMA busy_timeout=5000;')
+        conn.execute('PRAGMA temp_store=MEMORY;')
+        conn.execute('PRAGMA cache_size=-8000;')  # 每个连接 8MB 页缓存
+        conn.execute('PRAGMA mmap_size=67108864;')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """借出一个连接，代码块正常结束时提交、异常时回滚，之后归还连接池"""
+        self._available.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+                with self._lock:
+                    self._created += 1
+        except BaseException:
+            self._available.release()
+            raise
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._idle.put(conn)
+            self._available.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+pool = SqliteConnectionPool(CONVERSATION_DB_PATH)
+
+
+def _migrate_legacy_messages(conn):
+    """把旧版本保存在 chroma.sqlite3 中的对话记录复制到独立数据库，只执行一次，保留原表"""
+    if conn.execute("SELECT 1 FROM conversation_meta WHERE name = 'legacy_migrated';").fetchone():
+        return
+    if os.path.exists(LEGACY_DB_PATH):
+        conn.execute('ATTACH DATABASE ? AS legacy;', (LEGACY_DB_PATH,))
+        try:
+            legacy_exists = conn.execute(
+                "SELECT 1 FROM legacy.sqlite_master WHERE type='table' AND name='conversation_messages';"
+            ).fetchone()
+            if legacy_exists:
+                columns = {row[1] for row in conn.execute('PRAGMA legacy.table_info(conversation_messages);')}
+                status = "status" if "status" in columns else f"'{MESSAGE_STATUS_DONE}'"
+                cursor = conn.execute(f'''
+                INSERT OR IGNORE INTO main.conversation_messages ({_MESSAGE_COLUMNS})
+                SELECT id, user_id, session_id, parent_id, message_id, qa_id, qa_type, message_content,
+                       {status}, timestamp
+                FROM legacy.conversation_messages;
+                ''')
+                logger.info("已从 chroma.sqlite3 迁移 %d 条对话记录", cursor.rowcount)
+            conn.execute("INSERT INTO conversation_meta (name, value) VALUES ('legacy_migrated', '1');")
+            conn.commit()
+        finally:
+            conn.execute('DETACH DATABASE legacy;')
+    else:
+        conn.execute("INSERT INTO conversation_meta (name, value) VALUES ('legacy_migrated', '1');")
 
-    # 检查表是否存在
-    cursor.execute('''
-    SELECT name FROM sqlite_master WHERE type='table' AND name='conversation_messages';
+
+def _seed_qa_counters(conn):
+    """按已有记录中最大的 qa<N> 初始化各会话的计数器，只执行一次"""
+    if conn.execute("SELECT 1 FROM conversation_meta WHERE name = 'qa_counters_seeded';").fetchone():
+        return
+    conn.execute('''
+    INSERT OR IGNORE INTO conversation_qa_counters (user_id, session_id, last_qa_id)
+    SELECT user_id, session_id, MAX(CAST(SUBSTR(qa_id, 3) AS INTEGER))
+    FROM conversation_messages
+    WHERE qa_id LIKE 'qa%'
+    GROUP BY user_id, session_id;
     ''')
-    table_exists = cursor.fetchone()
+    conn.execute("INSERT INTO conversation_meta (name, value) VALUES ('qa_counters_seeded', '1');")
+
 
-    # 如果表不存在，则创建新表
-    if not table_exists:
-        cursor.execute('''
-        CREATE TABLE conversation_messages (
+def init_conversation_messages():
+    with pool.connection() as conn:
+        conn.executescript('''
+        CREATE TABLE IF NOT EXISTS conversation_messages (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id TEXT NOT NULL,
             session_id TEXT NOT NULL,
@@ -29,134 +192,86 @@ def init_conversation_messages():
             qa_id TEXT,
             qa_type TEXT,
             message_content TEXT,
+            status TEXT NOT NULL DEFAULT 'done',
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         );
-        ''')
-        conn.commit()
-        print("消息表已创建！")
-    else:
-        print("消息表已存在，无需创建。")
+        CREATE INDEX IF NOT EXISTS idx_conversation_messages_session
+            ON conversation_messages (user_id, session_id, qa_id, qa_type);
+        -- 历史分页：按会话取问题行（索引隐含 rowid，按 id 有序），再按 message_id 找对应回答
+        CREATE INDEX IF NOT EXISTS idx_conversation_messages_turns
+            ON conversation_messages (user_id, session_id, qa_type);
+        CREATE INDEX IF NOT EXISTS idx_conversation_messages_message
+            ON conversation_messages (message_id, qa_type, user_id, session_id);
 
-    # 关闭数据库连接
-    cursor.close()
-    conn.close()
+        CREATE TABLE IF NOT EXISTS conversation_meta (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        );
+
+        -- 每个会话一行的问答序号计数器
+        CREATE TABLE IF NOT EXISTS conversation_qa_counters (
+            user_id TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            last_qa_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, session_id)
+        ) WITHOUT ROWID;
+        ''')
+        _migrate_legacy_messages(conn)
+        _seed_qa_counters(conn)
+    logger.info("消息表已就绪：%s", CONVERSATION_DB_PATH)
 
 
 def insert_into_conversation_messages(user_id: str, session_id: str, parent_id: int, message_id: str, qa_id: int,
                                       qa_type: str,
-                                      message_content: str):
-    # 连接到 Chroma 的 SQLite 数据库
-    print(f'{parent_path}/chroma_db/chroma.sqlite3')
-    conn = sqlite3.connect(f'{parent_path}/chroma_db/chroma.sqlite3')
-    cursor = conn.cursor()
-
+                                      message_content: str, status: str = MESSAGE_STATUS_DONE):
     # 插入一条新消息到 conversation_messages 表
     try:
-        cursor.execute('''
-        INSERT INTO conversation_messages 
-        (user_id, session_id, parent_id, message_id, qa_id, qa_type, message_content) 
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, session_id, parent_id, message_id, qa_id, qa_type, message_content))
-
-        conn.commit()
-        print("数据插入成功！")
-
+        with pool.connection() as conn:
+            conn.execute(_INSERT_MESSAGE_SQL,
+                         (user_id, session_id, parent_id, message_id, qa_id, qa_type, message_content, status))
     except sqlite3.IntegrityError as e:
-        print("插入数据失败：", e)
-
-    # 关闭数据库连接
-    cursor.close()
-    conn.close()
-
-
-def query_session_history(user_id: str, session_id: str):
-    # 连接到 Chroma 的 SQLite 数据库
-    conn = sqlite3.connect(f'{parent_path}/chroma_db/chroma.sqlite3')
-    cursor = conn.cursor()
-
-    # 执行查询
-    cursor.execute('''
-    SELECT
-    q.qa_id AS qa_id,
-    q.qa_type,
-    q.user_id,
-    q.session_id,
-    q.message_content AS question,
-    (
-        SELECT a.message_content
-        FROM conversation_messages a
-        WHERE a.qa_id = q.qa_id
-          AND a.qa_type = 'answer'
-        ORDER BY a.timestamp DESC
-        LIMIT 1
-    ) AS answer
-    FROM
-        conversation_messages q
-    WHERE
-        q.qa_type = 'question'
-        AND q.user_id = '123'
-        AND q.session_id = 'huangrx'
-    ORDER BY
-        q.timestamp ASC;
-    ''')
-
-    fetchall = cursor.fetchall()
+        logger.error("插入数据失败：%s", e)
 
-    # 格式化结果为对话树
-    conversation_tree = [
-        {'question': row[1], 'answer': row[2]}
-        for row in fetchall if row[1] and row[2]
-    ]
 
-    # 关闭数据库连接
-    cursor.close()
-    conn.close()
+def insert_conversation_messages(rows: List[tuple]):
+    """
+    在一个事务中批量插入消息，rows 中每项为
+    (user_id, session_id, parent_id, message_id, qa_id, qa_type, message_content, status)
+    """
+    with pool.connection() as conn:
+        conn.executemany(_INSERT_MESSAGE_SQL, rows)
 
-    return conversation_tree
 
+def query_session_history(user_id: str, session_id: str, cursor: Optional[int] = None,
+                          limit: int = HISTORY_PAGE_SIZE, since: Optional[str] = None) -> dict:
+    """
+    按时间顺序分页查询会话的问答记录。
 
-def query_next_qa_id(user_id: str, session_id: str):
-    # 连接到 Chroma 的 SQLite 数据库
-    print(f'{parent_path}/chroma_db/chroma.sqlite3')
-    conn = sqlite3.connect(f'{parent_path}/chroma_db/chroma.sqlite3')
-    cursor = conn.cursor()
+    :param cursor: 上一页返回的 next_cursor，为空时从头开始
+    :param limit: 每页轮数，不超过 HISTORY_MAX_PAGE_SIZE
+    :param since: 只返回该时间（UTC，格式同 timestamp 列，如 2025-01-01 08:00:00）之后提问的轮次，用于增量同步
+    :return: {"items": [...], "next_cursor": 下一页游标，没有更多时为 None}
+    """
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    with pool.connection() as conn:
+        # 多取一行判断是否还有下一页
+        rows = conn.execute(_SESSION_HISTORY_SQL,
+                            (user_id, session_id, cursor or 0, since, since, limit + 1)).fetchall()
 
-    # 执行查询
-    cursor.execute('''
-    SELECT MAX(CAST(SUBSTR(qa_id, 1) AS INTEGER)) FROM conversation_messages
-    WHERE 
-    user_id = ?
-        AND session_id = ?
-    ORDER BY 
-        timestamp ASC;
-    ''', (user_id, session_id,))
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = items[-1]["cursor"] if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
 
-    max_qa_id = cursor.fetchone()[0]
 
-    # 关闭数据库连接
-    cursor.close()
-    conn.close()
-    return f'qa{(max_qa_id or 0) + 1}'
+def allocate_qa_id(user_id: str, session_id: str) -> str:
+    """为一轮问答分配序号（qa1、qa2 ...），问题与回答共用；并发请求各自得到不同的序号"""
+    with pool.connection() as conn:
+        qa_id = conn.execute(_ALLOCATE_QA_ID_SQL, (user_id, session_id)).fetchone()[0]
+    return f'qa{qa_id}'
 
 
 def query_top_message_id(user_id: str, session_id: str):
-    # 连接到 Chroma 的 SQLite 数据库
-    conn = sqlite3.connect(f'{parent_path}/chroma_db/chroma.sqlite3')
-    cursor = conn.cursor()
-
-    # 执行查询
-    cursor.execute('''
-    SELECT MAX(CAST(SUBSTR(qa_id, 1) AS INTEGER)) FROM conversation_messages
-    WHERE 
-        q.user_id = ?
-        AND q.session_id = ?
-    ORDER BY 
-        q.timestamp ASC;
-    ''', (user_id, session_id,))
-
-    max_qa_id = cursor.fetchone()[0]
-
-    # 关闭数据库连接
-    cursor.close()
-    conn.close()
-    return f'qa{(max_qa_id or 0) + 1}'
+    """查询会话下一轮将分配的序号，不占用序号"""
+    with pool.connection() as conn:
+        row = conn.execute(_LAST_QA_ID_SQL, (user_id, session_id)).fetchone()
+    return f'qa{(row[0] if row else 0) + 1}'
@@ -1,10 +1,25 @@
 import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+from itertools import islice
 
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-
+from core.base.exception import IngestionSupersededError
+from service.bulk_writer import BulkWriter
+from service.collection_router import CollectionRouter, create_chroma_client
+from service.content_hash import ChunkIdAllocator, hash_text
 from service.document_processor import load_and_split_document
+from service.embedding_cache import CachedEmbeddings
+from service.embedding_scheduler import BatchingEmbeddings
+from service.file_registry import (
+    FILE_STATUS_DONE, FILE_STATUS_FAILED, FILE_STATUS_INGESTING, find_file_by_hash, get_file, get_meta,
+    register_existing_files, register_file, set_meta, update_file,
+)
+from service.keyword_index import keyword_index
+from service.onnx_embeddings import EMBEDDING_BACKEND, create_base_embeddings
+from service.pdf_stream import PDF_STREAMING_ENABLED, iter_pdf_split_documents
 from service.sql import init_conversation_messages
 
 # 配置日志
@@ -20,54 +35,380 @@ grand_path = os.path.dirname(parent_path)
 
 # 🛠 配置部分
 persist_directory = f"{grand_path}/chroma_db"  # Chroma 本地持久化目录
-embeddings = HuggingFaceEmbeddings(
-    model_name=f'{grand_path}/models/bge-large-zh-v1.5',
-    model_kwargs={'device': 'cpu'},
-    encode_kwargs={'normalize_embeddings': True}
+embedding_model_name = f'{grand_path}/models/bge-large-zh-v1.5'
+# 不同后端的向量存在数值差异，缓存按后端区分
+embedding_cache_name = os.path.basename(embedding_model_name) + (
+    "" if EMBEDDING_BACKEND == "torch" else f"@{EMBEDDING_BACKEND}")
+# 向量模型外层依次包装微批次调度器和持久化缓存：缓存命中直接返回，未命中的文本跨请求合并前向计算
+embeddings = CachedEmbeddings(
+    BatchingEmbeddings(
+        create_base_embeddings(embedding_model_name, EMBEDDING_BACKEND)
+    ),
+    model_name=embedding_cache_name,
+    normalize=True,
+    cache_dir=f"{grand_path}/embedding_cache",
 )
 
 # 🟢 初始化本地向量数据库（如果已存在则加载）
 if not os.path.exists(persist_directory):
     os.makedirs(persist_directory)
 
-vector_store = Chroma(
-    persist_directory=persist_directory,
-    embedding_function=embeddings
-)
+# 每个租户一个集合，由路由器按需打开
+collection_router = CollectionRouter(create_chroma_client(persist_directory), embeddings)
 
 init_conversation_messages()
 
+# 流式写入时每批向量化/入库的文档块数
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 64))
+
+
+def _iter_split_documents(file_path):
+    """PDF 走流式解析逐块产出，其余格式在解析进程池中整体解析"""
+    if PDF_STREAMING_ENABLED and os.path.splitext(file_path)[-1].lower() == '.pdf':
+        return iter_pdf_split_documents(file_path)
+    return iter(load_and_split_document(file_path))
+
+
+def _iter_batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _file_where(user_id, session_id, file_path):
+    return {"$and": [{"user_id": user_id}, {"session_id": session_id}, {"file_path": file_path}]}
+
+
+def get_vector_store(user_id, session_id):
+    """获取租户对应的向量库，不存在时创建"""
+    return collection_router.get(user_id, session_id)
+
+
+def find_vector_store(user_id, session_id):
+    """只读获取租户对应的向量库，租户还没有集合时返回 None"""
+    return collection_router.find(user_id, session_id)
+
+
+def _iter_stored_chunks(include, batch_size=1000):
+    """分页遍历所有租户集合中已入库的文档块，逐页产出 Chroma get 的结果"""
+    client = collection_router.client
+    for collection in client.list_collections():
+        collection = client.get_collection(collection.name if hasattr(collection, "name") else collection)
+        for offset in range(0, collection.count(), batch_size):
+            yield collection.get(limit=batch_size, offset=offset, include=include)
+
+
+def _collect_files(files, metadatas):
+    """把块元数据按 (user_id, session_id, file_path) 汇总为文件登记信息，累加到 files 中"""
+    for metadata in metadatas:
+        if not metadata or not metadata.get("file_path"):
+            continue
+        key = (metadata.get("user_id", ""), metadata.get("session_id", ""), metadata["file_path"])
+        item = files.setdefault(key, {"user_id": key[0], "session_id": key[1], "file_path": key[2],
+                                      "upload_order": 0, "chunk_count": 0, "file_hash": None})
+        item["chunk_count"] += 1
+        item["upload_order"] = max(item["upload_order"], int(metadata.get("upload_order") or 0))
+        item["file_hash"] = item["file_hash"] or metadata.get("file_hash")
+
+
+def backfill_file_registry():
+    """
+    按向量库中的块元数据补登记文件登记表建立之前入库的文件，只执行一次。
+    否则这些文件在登记表中没有记录，下载接口会返回 404，重新上传时也无法识别为已入库。
+    """
+    if get_meta("registry_backfilled"):
+        return
+    files = {}
+    for page in _iter_stored_chunks(include=["metadatas"]):
+        _collect_files(files, page["metadatas"])
+    register_existing_files(list(files.values()))
+    set_meta("registry_backfilled", "1")
+    if files:
+        logger.info("已按向量库元数据补登记 %d 个文件", len(files))
+
+
+def backfill_keyword_index():
+    """
+    把关键词索引建立之前入库的文档块补写入倒排索引，只执行一次，否则这些块在 BM25 检索中不可见。
+    """
+    if keyword_index.get_meta("chroma_backfilled"):
+        return
+    added = 0
+    for page in _iter_stored_chunks(include=["metadatas", "documents"]):
+        missing = set(keyword_index.missing_ids(page["ids"]))
+        indexes = [i for i, chunk_id in enumerate(page["ids"])
+                   if chunk_id in missing and page["metadatas"][i]
+                   and all(page["metadatas"][i].get(key) for key in ("user_id", "session_id", "file_path"))]
+        keyword_index.add([page["ids"][i] for i in indexes], [page["documents"][i] for i in indexes],
+                          [page["metadatas"][i] for i in indexes])
+        added += len(indexes)
+    keyword_index.set_meta("chroma_backfilled", "1")
+    if added:
+        logger.info("已为 %d 个历史文档块补建关键词索引", added)
+
+
+def migrate_legacy_collection():
+    """
+    把分片前的共享集合迁移到租户集合，并为迁移的块写入关键词索引、补登记文件。
+    迁移的文件有了登记记录，重新上传时按增量入库并清理旧块，不会重复写入。
+    """
+    files = {}
+
+    def on_batch(ids, metadatas, documents):
+        keyword_index.add(ids, documents, metadatas)
+        _collect_files(files, metadatas)
+
+    if collection_router.migrate_legacy_collection(on_batch=on_batch):
+        register_existing_files(list(files.values()))
+        logger.info("共享集合中的 %d 个文件已补登记", len(files))
+
+
+def _find_reusable_embeddings(store, chunk_hashes):
+    """
+    按内容哈希查找租户集合中已有的向量，返回 {chunk_hash: embedding}。
+
+    分片后只查本租户的集合，不再逐个扫描其他租户的集合；跨租户的相同内容由 embeddings 外层的
+    持久化向量缓存（按文本内容寻址、所有租户共享）命中，同样跳过模型推理。
+    """
+    if not chunk_hashes:
+        return {}
+    results = store.get(where={"chunk_hash": {"$in": list(set(chunk_hashes))}},
+                        include=["metadatas", "embeddings"])
+    return {metadata["chunk_hash"]: embedding
+            for metadata, embedding in zip(results["metadatas"], results["embeddings"])}
+
+
+def _embed_batch(store, ids, docs, existing_ids):
+    """
+    为一批文档块准备写入数据：已存在的块只刷新元数据；库中已有相同内容的块复用其向量；
+    只对未见过的内容调用向量模型。
+    """
+    kept = [(chunk_id, doc) for chunk_id, doc in zip(ids, docs) if chunk_id in existing_ids]
+    added = [(chunk_id, doc) for chunk_id, doc in zip(ids, docs) if chunk_id not in existing_ids]
 
-# 📁 计算上传顺序的函数 (自动计算 upload_order)
-def get_next_upload_order(user_id, session_id):
-    # 首先获取符合条件的总记录数
-    results = vector_store.get(where={
-        "$and": [
-            {"user_id": user_id, },
-            {"session_id": session_id, }
-        ]
-    })
-    metadatas = results["metadatas"] if results else None
-    last_record = metadatas[-1] if metadatas else None
-    next_order = (last_record.get("upload_order", 0) if last_record else 0) + 1
-    return next_order
+    reusable = _find_reusable_embeddings(store, [doc.metadata["chunk_hash"] for _, doc in added])
+    fresh = [doc.page_content for _, doc in added if doc.metadata["chunk_hash"] not in reusable]
+    fresh_vectors = iter(embeddings.embed_documents(fresh) if fresh else [])
 
+    return {
+        "kept_ids": [chunk_id for chunk_id, _ in kept],
+        "kept_metadatas": [doc.metadata for _, doc in kept],
+        "ids": [chunk_id for chunk_id, _ in added],
+        "embeddings": [reusable[doc.metadata["chunk_hash"]] if doc.metadata["chunk_hash"] in reusable
+                       else next(fresh_vectors) for _, doc in added],
+        "metadatas": [doc.metadata for _, doc in added],
+        "documents": [doc.page_content for _, doc in added],
+        "reused": len(added) - len(fresh),
+        "embedded": len(fresh),
+    }
 
-# 📁 上传文档的函数 (自动获取 upload_order)
-def upload_file(file_path, user_id, session_id):
-    # 自动获取当前用户和会话的下一个上传顺序
-    upload_order = get_next_upload_order(user_id, session_id)
+
+def _write_batch(store, payload):
+    """在写入线程中把一批数据写入 Chroma，并同步更新关键词倒排索引"""
+    if payload["kept_ids"]:
+        store._collection.update(ids=payload["kept_ids"], metadatas=payload["kept_metadatas"])
+        keyword_index.update_metadata(payload["kept_ids"], payload["kept_metadatas"])
+    if payload["ids"]:
+        store._collection.upsert(ids=payload["ids"], embeddings=payload["embeddings"],
+                                 metadatas=payload["metadatas"], documents=payload["documents"])
+        keyword_index.add(payload["ids"], payload["documents"], payload["metadatas"])
+
+
+def _copy_file_chunks(file_hash, user_id, session_id, file_path, upload_order):
+    """
+    相同内容的文件已在其他会话入库时，直接复制其文档块和向量，无需重新解析与向量化。
+    返回复制的块数，没有可复制的来源时返回 0。
+    """
+    source = find_file_by_hash(file_hash)
+    if source is None:
+        return 0
+    results = get_vector_store(source["user_id"], source["session_id"]).get(
+        where=_file_where(source["user_id"], source["session_id"], source["file_path"]),
+        include=["metadatas", "documents", "embeddings"],
+    )
+
+    id_allocator = ChunkIdAllocator(user_id, session_id, file_path)
+    metadatas = [{**metadata, "user_id": user_id, "session_id": session_id,
+                  "file_path": file_path, "upload_order": upload_order}
+                 for metadata in results["metadatas"]]
+    store = get_vector_store(user_id, session_id)
+    for start in range(0, len(metadatas), STREAM_BATCH_SIZE):
+        end = start + STREAM_BATCH_SIZE
+        ids = id_allocator.allocate([metadata["chunk_hash"] for metadata in metadatas[start:end]])
+        store._collection.upsert(
+            ids=ids,
+            embeddings=results["embeddings"][start:end],
+            metadatas=metadatas[start:end],
+            documents=results["documents"][start:end],
+        )
+        keyword_index.add(ids, results["documents"][start:end], metadatas[start:end])
+    return len(metadatas)
+
+
+# (user_id, session_id, file_path) -> [文件锁, 等待或持有该锁的任务数]
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _file_lock(user_id, session_id, file_path):
+    """串行化同一文件的入库，避免两次入库交错删除旧块、覆盖断点和登记记录"""
+    key = (user_id, session_id, file_path)
+    with _file_locks_guard:
+        entry = _file_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _file_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _file_locks[key]
+
+
+# 📁 上传文档的函数 (上传顺序由文件登记表分配)
+def upload_file(file_path, user_id, session_id, file_hash=None, on_stage=None, is_superseded=None):
+    """
+    解析、切分并向量化文件，写入向量数据库，并在文件登记表中记录块数与耗时。
+
+    文档块按 STREAM_BATCH_SIZE 分批向量化入库，PDF 的首批文档块在解析完成前即可入库。
+    入库按内容去重：文件内容未变化时直接跳过；相同文件已在其他会话入库时复制其向量；
+    重新上传修改过的文件时只向量化新增或变化的块，并删除已不存在的块。
+
+    同一文件的入库按文件加锁串行执行；is_superseded 返回 True 时（同一文件已有更新的任务），
+    在开始前或下一个批次前抛出 IngestionSupersededError，登记记录保持入库中状态，由新任务增量覆盖。
+
+    :param on_stage: 可选的阶段回调，签名为 on_stage(stage, **info)，用于上报 parsing/embedding 进度
+    :param is_superseded: 可选的回调，返回当前任务是否已被同一文件的新任务取代
+    :return: 文件对应的文档块数量
+    """
+    with _file_lock(user_id, session_id, file_path):
+        if is_superseded and is_superseded():
+            raise IngestionSupersededError(f"文件 '{file_path}' 已有更新的入库任务")
+        return _upload_file_locked(file_path, user_id, session_id, file_hash, on_stage, is_superseded)
+
+
+def _upload_file_locked(file_path, user_id, session_id, file_hash, on_stage, is_superseded):
+    previous = get_file(user_id, session_id, file_path)
+    if file_hash and previous and previous["file_hash"] == file_hash and previous["status"] == FILE_STATUS_DONE:
+        logger.info("文件 '%s' 内容未变化，跳过入库", file_path)
+        return previous["chunk_count"]
+
+    # 同一内容上次入库中断（进程崩溃或重启）时，从最后一个已提交的批次之后继续
+    resume_from = 0
+    if previous and previous["status"] == FILE_STATUS_INGESTING and previous["file_hash"] == file_hash:
+        resume_from = previous["committed_chunks"] or 0
+
+    record = register_file(user_id, session_id, file_path, size=os.path.getsize(file_path), file_hash=file_hash)
+    if not resume_from:
+        update_file(record["id"], committed_chunks=0)
+    try:
+        stats = _ingest_file(file_path, user_id, session_id, file_hash, record,
+                             incremental=previous is not None, resume_from=resume_from, on_stage=on_stage,
+                             is_superseded=is_superseded)
+    except IngestionSupersededError:
+        raise
+    except Exception:
+        update_file(record["id"], status=FILE_STATUS_FAILED)
+        raise
+    update_file(record["id"], status=FILE_STATUS_DONE, **stats)
+    return stats["chunk_count"]
+
+
+def _ingest_file(file_path, user_id, session_id, file_hash, record, incremental, resume_from, on_stage,
+                 is_superseded=None):
+    """
+    返回入库统计 {chunk_count, parse_ms, embed_ms, chunks_per_s}。
+
+    解析、向量化与写入按批次流水线执行：第 N 批写入 Chroma 的同时向量化第 N+1 批，
+    每批提交后记录已提交的块数作为断点，续传时完全落在前 resume_from 个块内的批次直接跳过。
+    """
+    started = time.perf_counter()
+    upload_order = record["upload_order"]
+    store = get_vector_store(user_id, session_id)
+
+    # 只有同名文件曾经入库过才需要查询已有的块做增量对比
+    existing_ids = set()
+    if incremental:
+        existing_ids = set(store.get(where=_file_where(user_id, session_id, file_path), include=[])["ids"])
+
+    if file_hash and not existing_ids:
+        copied = _copy_file_chunks(file_hash, user_id, session_id, file_path, upload_order)
+        if copied:
+            logger.info("📥 文件 '%s' 与已入库文件内容相同，已复用 %d 个文档块的向量", file_path, copied)
+            elapsed = time.perf_counter() - started
+            return {"chunk_count": copied, "parse_ms": 0, "embed_ms": int(elapsed * 1000),
+                    "chunks_per_s": round(copied / elapsed, 1) if elapsed > 0 else None}
 
     # 加载和分割文档
-    split_docs = load_and_split_document(file_path)
-
-    # 添加元数据 (自动计算的 upload_order)
-    for doc in split_docs:
-        doc.metadata["user_id"] = user_id
-        doc.metadata["session_id"] = session_id
-        doc.metadata["file_path"] = file_path
-        doc.metadata["upload_order"] = upload_order
-
-    # 添加文档到向量数据库并持久化
-    vector_store.add_documents(split_docs)
-    print(f"📥 文件 '{file_path}' 已上传并存储到数据库！ (upload_order={upload_order})")
+    if on_stage:
+        on_stage("parsing")
+    split_docs = _iter_split_documents(file_path)
+
+    # 批次序号 -> 该批次结束位置（文件内累计块数），批次写入成功后作为断点保存
+    batch_ends = {}
+
+    def on_commit(batch_no, _):
+        committed_chunks = batch_ends.pop(batch_no)
+        update_file(record["id"], committed_chunks=committed_chunks)
+        if on_stage:
+            on_stage("progress", chunk_count=committed_chunks, chunks_per_s=round(writer.throughput, 1))
+
+    writer = BulkWriter(partial(_write_batch, store), on_commit=on_commit)
+    id_allocator = ChunkIdAllocator(user_id, session_id, file_path)
+    seen_ids = set()
+    chunk_count = embedded_count = reused_count = 0
+    embed_seconds = 0.0
+    try:
+        for batch_no, batch in enumerate(_iter_batches(split_docs, STREAM_BATCH_SIZE)):
+            if is_superseded and is_superseded():
+                raise IngestionSupersededError(f"文件 '{file_path}' 已有更新的入库任务")
+            if chunk_count == 0 and on_stage:
+                on_stage("embedding")
+            batch_started = time.perf_counter()
+
+            # 添加元数据 (登记表分配的 upload_order)
+            for doc in batch:
+                doc.metadata["user_id"] = user_id
+                doc.metadata["session_id"] = session_id
+                doc.metadata["file_path"] = file_path
+                doc.metadata["upload_order"] = upload_order
+                doc.metadata["chunk_hash"] = hash_text(doc.page_content)
+                if file_hash:
+                    doc.metadata["file_hash"] = file_hash
+
+            ids = id_allocator.allocate([doc.metadata["chunk_hash"] for doc in batch])
+            seen_ids.update(ids)
+            chunk_count += len(batch)
+            if chunk_count <= resume_from:
+                continue
+
+            # 向量化本批次，上一批次此时仍在后台写入
+            payload = _embed_batch(store, ids, batch, existing_ids)
+            batch_ends[batch_no] = chunk_count
+            reused_count += payload["reused"]
+            embedded_count += payload["embedded"]
+            writer.submit(batch_no, len(batch), payload)
+            embed_seconds += time.perf_counter() - batch_started
+    finally:
+        writer.close()
+
+    stale_ids = existing_ids - seen_ids
+    if stale_ids:
+        store.delete(ids=list(stale_ids))
+        keyword_index.delete(list(stale_ids))
+
+    if chunk_count == 0 and on_stage:
+        on_stage("embedding")
+    logger.info("📥 文件 '%s' 已上传并存储到数据库！ (upload_order=%d, chunks=%d, 新向量化=%d, 复用向量=%d, "
+                "删除=%d, 续传跳过块数=%d, 吞吐=%.1f 块/秒)",
+                file_path, upload_order, chunk_count, embedded_count, reused_count, len(stale_ids),
+                resume_from, writer.throughput)
+    total_seconds = time.perf_counter() - started
+    return {
+        "chunk_count": chunk_count,
+        "parse_ms": int((total_seconds - embed_seconds) * 1000),
+        "embed_ms": int(embed_seconds * 1000),
+        "chunks_per_s": round(writer.throughput, 1),
+    }